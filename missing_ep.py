@@ -2,218 +2,431 @@
 # -*- coding: utf-8 -*-
 
 import requests
+import io
 import json
 import os
 import sys
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 import urllib3
+from urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
 import re
 import argparse
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# --- Argument Parsing ---
-parser = argparse.ArgumentParser(description='Busca episodios de TV faltantes en Plex comparando con TheTVDB API v4.')
-parser.add_argument('-d', '--debug', action='store_true', help='Activa el modo de depuración.')
-args = parser.parse_args()
-
-# --- Configuration Loading ---
-CONFIG_FILE_PATH = 'plex.config.json'
-CONFIG = {}
+# orjson (opcional) parsea los payloads grandes de TVDB /extended varias veces más rápido que json
 try:
-    with open(CONFIG_FILE_PATH, 'r') as f: CONFIG = json.load(f)
-except FileNotFoundError: print(f"Error: Configuración no encontrada: {CONFIG_FILE_PATH}"); sys.exit(1)
-except json.JSONDecodeError: print(f"Error: JSON inválido: {CONFIG_FILE_PATH}"); sys.exit(1)
-except Exception as e: print(f"Error leyendo configuración: {e}"); sys.exit(1)
-
-# --- Extract Configuration Variables ---
-PLEX_BASE_URL = CONFIG.get("PLEX_BASE_URL")
-PLEX_TOKEN = CONFIG.get("PLEX_TOKEN")
-THETVDB_APIKEY = CONFIG.get("THETVDB_APIKEY")
-IGNORE_LIST = CONFIG.get("IGNORE_LIST", [])
-CONFIG_DEBUG = CONFIG.get("DEBUG", False)
-
-# --- Determine Debug Mode ---
-DEBUG_MODE = args.debug or CONFIG_DEBUG
-if DEBUG_MODE: print("**** MODO DEBUG ACTIVADO ****")
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
 
-# --- Debug Print Helper ---
-def debug_print(message):
-    if DEBUG_MODE: print(f"[DEBUG] {message}")
+# ijson (opcional) permite leer solo data.episodes de TVDB /extended en streaming
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
-# --- Basic Validation ---
-if not all([PLEX_BASE_URL, PLEX_TOKEN, THETVDB_APIKEY]):
-    print("Error: Faltan variables requeridas."); sys.exit(1)
+# httpx con HTTP/2 (opcional, `pip install httpx[http2]`) multiplexa todas las peticiones a TheTVDB
+# sobre una única conexión TLS en lugar de abrir una conexión HTTP/1.1 por hilo
+try:
+    import httpx
+    import h2 # noqa: F401 - solo se comprueba que el soporte HTTP/2 está instalado
+except ImportError:
+    httpx = None
 
 # --- Constants ---
+CONFIG_FILE_PATH = 'plex.config.json'
 TVDB_API_BASE_URL = "https://api4.thetvdb.com/v4"
-PLEX_HEADERS = {
-    "X-Plex-Token": PLEX_TOKEN, "Accept": "application/json",
-    "X-Plex-Client-Identifier": "PythonMissingTVEpisodesScript",
-    "X-Plex-Product": "Python Script", "X-Plex-Version": "V1"
-}
 TVDB_HEADERS = { "Accept": "application/json", "Content-Type": "application/json" }
+TVDB_EPISODE_FIELDS = ("seasonNumber", "number", "name", "aired") # Únicos campos de episodio que se usan
+_TVDB_GUID_RE = re.compile(r'(?:tvdb|thetvdb)://(\d+)')
+_WHITESPACE_RE = re.compile(r'\s+')
+_EMPTY_SEASON = {"nums": frozenset(), "names": frozenset()} # Temporada ausente en Plex
+AIRED_CUTOFF = date.today() - timedelta(days=1) # Episodios emitidos a partir de ayer se ignoran
+
+# --- Global State (se rellena en load_config() e init_sessions()) ---
+PLEX_BASE_URL = None
+PLEX_TOKEN = None
+THETVDB_APIKEY = None
+IGNORE_LIST = []
+TVDB_CACHE_FILE = "tvdb_cache.json"
+MISSING_JSON_FILE = "missing.json" # Copia en JSON de los faltantes para otras herramientas
+PLEX_MAX_WORKERS = 16 # Peticiones simultáneas contra el servidor Plex
+TVDB_MAX_WORKERS = 8  # Peticiones simultáneas contra TheTVDB
+DEBUG_MODE = False
+PLEX_SESSION = None
+TVDB_SESSION = None
+TVDB_CACHE = {}
 
-# --- Ignore Plex Certificate Issues ---
-VERIFY_SSL = True
-if PLEX_BASE_URL.startswith("https"):
-    try: requests.get(PLEX_BASE_URL, timeout=5)
-    except requests.exceptions.SSLError:
-        print("Advertencia: Problema SSL Plex. Deshabilitando verificación.")
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        VERIFY_SSL = False
-    except requests.exceptions.RequestException: pass
+# --- Debug Print Helper ---
+def debug_print(message):
+    if DEBUG_MODE: print(f"[DEBUG] {message}")
+
+# --- Configuration Loading ---
+def load_config(debug_flag):
+    """Lee plex.config.json, valida las variables requeridas y fija las globales de configuración."""
+    global PLEX_BASE_URL, PLEX_TOKEN, THETVDB_APIKEY, IGNORE_LIST, TVDB_CACHE_FILE, MISSING_JSON_FILE
+    global PLEX_MAX_WORKERS, TVDB_MAX_WORKERS, DEBUG_MODE
+    try:
+        with open(CONFIG_FILE_PATH, 'r') as f: config = json.load(f)
+    except FileNotFoundError: print(f"Error: Configuración no encontrada: {CONFIG_FILE_PATH}"); sys.exit(1)
+    except json.JSONDecodeError: print(f"Error: JSON inválido: {CONFIG_FILE_PATH}"); sys.exit(1)
+    except Exception as e: print(f"Error leyendo configuración: {e}"); sys.exit(1)
+
+    PLEX_BASE_URL = config.get("PLEX_BASE_URL")
+    PLEX_TOKEN = config.get("PLEX_TOKEN")
+    THETVDB_APIKEY = config.get("THETVDB_APIKEY")
+    IGNORE_LIST = config.get("IGNORE_LIST", [])
+    TVDB_CACHE_FILE = config.get("TVDB_CACHE_FILE", TVDB_CACHE_FILE)
+    MISSING_JSON_FILE = config.get("MISSING_JSON_FILE", MISSING_JSON_FILE)
+    PLEX_MAX_WORKERS = int(config.get("PLEX_MAX_WORKERS", PLEX_MAX_WORKERS))
+    TVDB_MAX_WORKERS = int(config.get("TVDB_MAX_WORKERS", TVDB_MAX_WORKERS))
+
+    DEBUG_MODE = debug_flag or config.get("DEBUG", False)
+    if DEBUG_MODE: print("**** MODO DEBUG ACTIVADO ****")
+
+    if not all([PLEX_BASE_URL, PLEX_TOKEN, THETVDB_APIKEY]):
+        print("Error: Faltan variables requeridas."); sys.exit(1)
+
+# --- HTTP Sessions (una por host, con pool de conexiones reutilizables) ---
+def build_session(headers, verify, max_workers):
+    # pool_maxsize >= hilos simultáneos para que ningún hilo abra (y descarte) conexiones fuera del pool
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(32, max_workers),
+                          max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]))
+    session.mount("http://", adapter); session.mount("https://", adapter)
+    session.headers.update(headers)
+    session.verify = verify
+    return session
+
+def build_tvdb_client():
+    """Cliente para TheTVDB: httpx con HTTP/2 si está disponible; si no, una requests.Session con pool."""
+    if httpx is None: return build_session(TVDB_HEADERS, True, TVDB_MAX_WORKERS)
+    transport = httpx.HTTPTransport(http2=True, retries=3,
+                                    limits=httpx.Limits(max_connections=max(32, TVDB_MAX_WORKERS)))
+    return httpx.Client(transport=transport, headers=TVDB_HEADERS, timeout=45)
+
+def init_sessions():
+    """Comprueba el certificado de Plex y crea las sesiones HTTP de Plex y TheTVDB."""
+    global PLEX_SESSION, TVDB_SESSION
+    # --- Ignore Plex Certificate Issues ---
+    verify_ssl = True
+    if PLEX_BASE_URL.startswith("https"):
+        try: requests.get(PLEX_BASE_URL, timeout=5)
+        except requests.exceptions.SSLError:
+            print("Advertencia: Problema SSL Plex. Deshabilitando verificación.")
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+            verify_ssl = False
+        except requests.exceptions.RequestException: pass
+    plex_headers = {
+        "X-Plex-Token": PLEX_TOKEN, "Accept": "application/json",
+        "X-Plex-Client-Identifier": "PythonMissingTVEpisodesScript",
+        "X-Plex-Product": "Python Script", "X-Plex-Version": "V1"
+    }
+    PLEX_SESSION = build_session(plex_headers, verify_ssl, PLEX_MAX_WORKERS)
+    TVDB_SESSION = build_tvdb_client()
+
+# --- Aired Date Parsing ---
+def _parse_aired(aired_str):
+    """Convierte 'AAAA-MM-DD' en date troceando la cadena (mucho más rápido que strptime). None si no es válida."""
+    if len(aired_str) != 10 or aired_str[4] != '-' or aired_str[7] != '-': return None
+    try: return date(int(aired_str[0:4]), int(aired_str[5:7]), int(aired_str[8:10]))
+    except ValueError: return None
+
+def _aired_season(tvdb_episode):
+    """Temporada (str) de un episodio TVDB ya emitido y fuera de especiales; None si no cuenta."""
+    if not isinstance(tvdb_episode, dict): return None
+    season_num = tvdb_episode.get("seasonNumber")
+    if not season_num or tvdb_episode.get("number") is None: return None
+    aired_str = tvdb_episode.get("aired")
+    if not aired_str: return None
+    aired_date = _parse_aired(aired_str)
+    if aired_date is None or aired_date >= AIRED_CUTOFF: return None
+    return str(season_num)
+
+# --- Episode Title Normalization ---
+def _norm_title(title):
+    """Normaliza un título para compararlo: sin mayúsculas/minúsculas y con espacios colapsados."""
+    return _WHITESPACE_RE.sub(' ', title.casefold().strip())
+
+# --- Missing Episode Detection ---
+# Se mantiene como función (y no en el nivel del módulo) para que el bucle trabaje con variables
+# locales en lugar de con búsquedas en el diccionario de globales en cada iteración.
+def find_missing_episodes(show_title, plex_seasons, tvdb_episodes):
+    """Recorre una sola vez los episodios de TVDB y devuelve (faltantes, Counter de emitidos por temporada).
+    Un episodio falta si no está en Plex ni por número ni por título."""
+    missing = []
+    tvdb_episode_counts = Counter()
+    for tvdb_episode in tvdb_episodes:
+        try:
+            tvdb_season_num_str = _aired_season(tvdb_episode)
+            if tvdb_season_num_str is None: continue
+            tvdb_episode_counts[tvdb_season_num_str] += 1
+            plex_season = plex_seasons.get(tvdb_season_num_str, _EMPTY_SEASON)
+            try: tvdb_episode_num_int = int(tvdb_episode["number"])
+            except (ValueError, TypeError): continue
+            tvdb_episode_name = tvdb_episode.get("name")
+            found_by_number = tvdb_episode_num_int in plex_season["nums"]
+            found_by_name = bool(tvdb_episode_name) and _norm_title(tvdb_episode_name) in plex_season["names"]
+            if not found_by_number and not found_by_name:
+                missing.append({
+                    "season": tvdb_season_num_str, "episode": str(tvdb_episode_num_int),
+                    "name": tvdb_episode_name or "Nombre Desconocido"
+                })
+        except Exception as e:
+            print(f"Error inesperado procesando episodio TVDB '{show_title}': {tvdb_episode}\nError: {e}")
+            continue
+    return missing, tvdb_episode_counts
 
 # --- Helper Function for API Requests ---
+# Errores HTTP de ambas librerías (TVDB puede ir por httpx y Plex siempre va por requests)
+HTTP_STATUS_ERRORS = (requests.exceptions.HTTPError,) + ((httpx.HTTPStatusError,) if httpx else ())
+
 def make_request(url, method="GET", headers=None, json_data=None, params=None, stream=False, is_tvdb=False):
-    session_verify_ssl = VERIFY_SSL if not is_tvdb else True
+    session = TVDB_SESSION if is_tvdb else PLEX_SESSION
     try:
-        response = requests.request(method, url, headers=headers, json=json_data, params=params,
-                                    verify=session_verify_ssl, timeout=45, stream=stream)
-        response.raise_for_status()
+        if httpx is not None and isinstance(session, httpx.Client):
+            request = session.build_request(method, url, headers=headers, json=json_data, params=params)
+            response = session.send(request, stream=stream)
+        else:
+            response = session.request(method, url, headers=headers, json=json_data, params=params,
+                                       timeout=45, stream=stream)
+        # httpx también trata los 3xx como error; el 304 de las peticiones condicionales es válido
+        if response.status_code >= 400:
+            response.close() # Con stream=True la conexión (o el stream HTTP/2) no vuelve al pool hasta cerrarla
+            response.raise_for_status()
         if not stream and 'application/json' in response.headers.get('Content-Type', ''):
             if response.status_code == 204: return None
-            return response.json()
+            return _json_loads(response.content)
         return response
-    except requests.exceptions.HTTPError as e:
-        print(f"Error HTTP: {e.response.status_code} - {e.response.reason} para {url}")
+    except HTTP_STATUS_ERRORS as e:
+        reason = getattr(e.response, "reason", None) or getattr(e.response, "reason_phrase", "")
+        print(f"Error HTTP: {e.response.status_code} - {reason} para {url}")
         # ... (más manejo específico de errores) ...
     except Exception as e: # Catch other request errors
         print(f"Error en petición a {url}: {e}")
     return None
 
+# --- Helper Functions for Concurrent Requests ---
+def map_parallel(func, items, max_workers):
+    """Aplica `func` a cada elemento en paralelo y devuelve los resultados en el mismo orden que `items`."""
+    items = list(items)
+    if not items: return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+def fetch_all(urls, max_workers, **kwargs):
+    return map_parallel(lambda url: make_request(url, **kwargs), urls, max_workers)
+
+# --- TheTVDB /extended Cache (ETag / Last-Modified) ---
+def load_tvdb_cache(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+    except FileNotFoundError: return {}
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Advertencia: Caché TVDB ilegible ({path}): {e}. Se ignorará."); return {}
+
+def save_tvdb_cache(path, cache):
+    try:
+        with open(path, 'w', encoding='utf-8') as f: json.dump(cache, f, ensure_ascii=False)
+    except OSError as e: print(f"Advertencia: No se pudo guardar la caché TVDB ({path}): {e}")
+
+def iter_response_body(response, chunk_size=65536):
+    """Trozos del cuerpo ya descomprimidos, tanto para respuestas de requests como de httpx."""
+    if hasattr(response, "iter_bytes"): return response.iter_bytes(chunk_size)
+    return response.iter_content(chunk_size)
+
+def read_tvdb_extended(response, tvdb_id):
+    """Lee el cuerpo de /extended. Con ijson solo se recorre data.episodes y se descartan
+    artworks, traducciones, personajes, etc. sin llegar a construirlos en memoria."""
+    if ijson is None:
+        try: return _json_loads(response.read() if hasattr(response, "iter_bytes") else response.content)
+        except ValueError as e: print(f"Error: JSON inválido de TVDB para ID {tvdb_id}: {e}"); return None
+    # Interfaz push de ijson: se le van enviando los trozos según llegan por la red
+    episodes = []
+    found = ijson.sendable_list()
+    parser = ijson.items_coro(found, 'data.episodes.item')
+    try:
+        for chunk in iter_response_body(response):
+            parser.send(chunk)
+            episodes.extend({k: ep.get(k) for k in TVDB_EPISODE_FIELDS} for ep in found if isinstance(ep, dict))
+            del found[:]
+        parser.close()
+        episodes.extend({k: ep.get(k) for k in TVDB_EPISODE_FIELDS} for ep in found if isinstance(ep, dict))
+    except Exception as e: print(f"Error leyendo respuesta TVDB para ID {tvdb_id}: {e}"); return None
+    return {"data": {"episodes": episodes}}
+
+def fetch_tvdb_extended(tvdb_id):
+    """Descarga /series/{id}/extended con una petición condicional; si TVDB responde 304 reutiliza la caché."""
+    cached = TVDB_CACHE.get(tvdb_id)
+    headers = {}
+    if cached:
+        if cached.get("etag"): headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"): headers["If-Modified-Since"] = cached["last_modified"]
+    url = f"{TVDB_API_BASE_URL}/series/{tvdb_id}/extended"
+    response = make_request(url, headers=headers, params={"meta": "episodes"}, stream=True, is_tvdb=True)
+    if response is None: return None
+    try:
+        if response.status_code == 304 and cached:
+            debug_print(f"  TVDB {tvdb_id} sin cambios (304). Usando caché.")
+            return {"data": {"episodes": cached["episodes"]}}
+        tvdb_response = read_tvdb_extended(response, tvdb_id)
+    finally: response.close()
+    series_data = tvdb_response.get("data") if isinstance(tvdb_response, dict) else None
+    etag = response.headers.get("ETag"); last_modified = response.headers.get("Last-Modified")
+    if (etag or last_modified) and isinstance(series_data, dict) and isinstance(series_data.get("episodes"), list):
+        # Solo se guardan los campos que usa la comparación, no artworks/traducciones/personajes.
+        episodes = [{k: ep.get(k) for k in TVDB_EPISODE_FIELDS}
+                    for ep in series_data["episodes"] if isinstance(ep, dict)]
+        TVDB_CACHE[tvdb_id] = {"etag": etag, "last_modified": last_modified, "episodes": episodes}
+    return tvdb_response
+
+
 # --- TheTVDB Authentication ---
-print("Autenticando con TheTVDB API v4...")
-tvdb_auth_data = { "apikey": THETVDB_APIKEY }
-tvdb_login_response = make_request(f"{TVDB_API_BASE_URL}/login", method="POST", json_data=tvdb_auth_data, headers=TVDB_HEADERS, is_tvdb=True)
-if not tvdb_login_response or "data" not in tvdb_login_response or "token" not in tvdb_login_response.get("data", {}):
-    print("Error Crítico: Fallo al obtener token TVDB v4."); sys.exit(1)
-TVDB_TOKEN = tvdb_login_response["data"]["token"]
-TVDB_HEADERS["Authorization"] = f"Bearer {TVDB_TOKEN}"
-TVDB_HEADERS.pop("Content-Type", None)
-print("Autenticación con TheTVDB API v4 exitosa.")
+def tvdb_login():
+    print("Autenticando con TheTVDB API v4...")
+    tvdb_auth_data = { "apikey": THETVDB_APIKEY }
+    tvdb_login_response = make_request(f"{TVDB_API_BASE_URL}/login", method="POST", json_data=tvdb_auth_data, is_tvdb=True)
+    if not tvdb_login_response or "data" not in tvdb_login_response or "token" not in tvdb_login_response.get("data", {}):
+        print("Error Crítico: Fallo al obtener token TVDB v4."); sys.exit(1)
+    TVDB_SESSION.headers["Authorization"] = f"Bearer {tvdb_login_response['data']['token']}"
+    TVDB_SESSION.headers.pop("Content-Type", None)
+    print("Autenticación con TheTVDB API v4 exitosa.")
 
 # --- Get Plex TV Show Library Keys ---
-print("Obteniendo secciones de librería de TV de Plex...")
-sections_url = f"{PLEX_BASE_URL}/library/sections"
-sections_response = make_request(sections_url, headers=PLEX_HEADERS)
-
-# <<< --- CORRECCIÓN: Asegurarse de que tv_keys se inicializa ANTES del bloque if/else --- >>>
-tv_keys = []
-
-if sections_response and "MediaContainer" in sections_response and "Directory" in sections_response["MediaContainer"]:
-    for directory in sections_response["MediaContainer"]["Directory"]:
-        if directory.get("type") == "show" and "key" in directory:
-            key = directory["key"]; title = directory.get("title", "Sin Título")
-            # Quitar el debug print aquí para reducir ruido si no es necesario
-            # debug_print(f"Sección TV encontrada: '{title}' (Key: {key})")
-            tv_keys.append(key)
-else:
-    # Este error es crítico, si no podemos obtener secciones, no podemos continuar.
-    print("Error Crítico: No se pudieron obtener las secciones de la librería de Plex o la respuesta fue inválida.")
-    sys.exit(1) # Salir si no hay secciones
-
-# Ahora tv_keys existe, aunque podría estar vacía si no se encontraron secciones 'show'.
-if not tv_keys:
-    # Esto es una advertencia, no un error crítico si el servidor respondió pero no había secciones de TV.
-    print("Advertencia: No se encontraron secciones de librería de tipo 'show' en Plex.")
-    # Podríamos decidir salir aquí también si no hay nada que procesar:
-    # sys.exit(0)
-
-# Esta línea ahora es segura porque tv_keys está definida.
-print(f"Se encontraron {len(tv_keys)} secciones de TV.") # <-- Línea 108 (aprox)
-
+def get_tv_section_keys():
+    print("Obteniendo secciones de librería de TV de Plex...")
+    sections_response = make_request(f"{PLEX_BASE_URL}/library/sections")
+    tv_keys = []
+    if sections_response and "MediaContainer" in sections_response and "Directory" in sections_response["MediaContainer"]:
+        for directory in sections_response["MediaContainer"]["Directory"]:
+            if directory.get("type") == "show" and "key" in directory:
+                tv_keys.append(directory["key"])
+    else:
+        # Este error es crítico, si no podemos obtener secciones, no podemos continuar.
+        print("Error Crítico: No se pudieron obtener las secciones de la librería de Plex o la respuesta fue inválida.")
+        sys.exit(1)
+    if not tv_keys:
+        # Esto es una advertencia, no un error crítico si el servidor respondió pero no había secciones de TV.
+        print("Advertencia: No se encontraron secciones de librería de tipo 'show' en Plex.")
+    print(f"Se encontraron {len(tv_keys)} secciones de TV.")
+    return tv_keys
 
 # --- Get All Rating Keys ---
-# ... (resto del código sin cambios desde aquí) ...
-print("Recopilando claves de calificación (ratingKeys) de las series...")
-all_rating_keys = set()
-for key in tv_keys: # Ahora seguro iterar sobre tv_keys
-    debug_print(f"Obteniendo series de sección {key}")
-    series_list_url = f"{PLEX_BASE_URL}/library/sections/{key}/all"
-    series_response = make_request(series_list_url, headers=PLEX_HEADERS)
-    if series_response and "MediaContainer" in series_response:
-        content_list = series_response["MediaContainer"].get("Metadata") or series_response["MediaContainer"].get("Directory")
-        if content_list is not None:
-             for series in content_list:
-                 title = series.get("title"); rating_key = series.get("ratingKey")
-                 if title and rating_key:
-                     if title not in IGNORE_LIST: all_rating_keys.add(rating_key)
-        else: print(f"Advertencia: Sección {key} sin 'Metadata'/'Directory'.")
-    else: print(f"Advertencia: No se obtuvieron series para sección {key}.")
-print(f"Se encontraron {len(all_rating_keys)} series únicas (después de ignorar).")
+def get_all_series(tv_keys):
+    """Devuelve ratingKey -> entrada del listado (title, guid, Guid...) de todas las secciones de TV.
+    includeGuids=1 hace que Plex incluya los 'Guid' de cada serie en el propio listado de la sección,
+    evitando una petición /library/metadata/{ratingKey} por serie."""
+    print("Recopilando claves de calificación (ratingKeys) de las series...")
+    all_series = {}
+    series_urls = [f"{PLEX_BASE_URL}/library/sections/{key}/all?includeGuids=1&type=2" for key in tv_keys]
+    series_responses = fetch_all(series_urls, PLEX_MAX_WORKERS)
+    for key, series_response in zip(tv_keys, series_responses):
+        debug_print(f"Obteniendo series de sección {key}")
+        if series_response and "MediaContainer" in series_response:
+            content_list = series_response["MediaContainer"].get("Metadata") or series_response["MediaContainer"].get("Directory")
+            if content_list is not None:
+                 for series in content_list:
+                     title = series.get("title"); rating_key = series.get("ratingKey")
+                     if title and rating_key:
+                         if title not in IGNORE_LIST: all_series[rating_key] = series
+            else: print(f"Advertencia: Sección {key} sin 'Metadata'/'Directory'.")
+        else: print(f"Advertencia: No se obtuvieron series para sección {key}.")
+    print(f"Se encontraron {len(all_series)} series únicas (después de ignorar).")
+    return all_series
 
 # --- Get All Show Data from Plex ---
-print("Recopilando datos detallados de las series desde Plex...")
-plex_shows = {}
-count = 0
-total_keys = len(all_rating_keys)
-for rating_key in sorted(list(all_rating_keys)):
-    count += 1
-    metadata_url = f"{PLEX_BASE_URL}/library/metadata/{rating_key}"
-    show_data_response = make_request(metadata_url, headers=PLEX_HEADERS)
-    if show_data_response and "MediaContainer" in show_data_response and "Metadata" in show_data_response["MediaContainer"]:
-        show_data = show_data_response["MediaContainer"]["Metadata"][0]
+def extract_tvdb_ids(all_series):
+    """Agrupa las series de Plex por TVDB ID: tvdb_id -> {title, ratingKeys, seasons}."""
+    print("Extrayendo TVDB IDs de las series...")
+    plex_shows = {}
+    count = 0
+    total_keys = len(all_series)
+    for rating_key in sorted(all_series):
+        count += 1
+        show_data = all_series[rating_key]
         title = show_data.get("title")
         primary_guid = show_data.get("guid")
         if DEBUG_MODE or count % 10 == 0 or count == total_keys:
-             print(f"Procesando Plex: [{count}/{total_keys}] {title or 'Título Desconocido'}")
-
-        if not title: print(f"Advertencia: Omitida RK {rating_key} (sin título)."); continue
+             print(f"Procesando Plex: [{count}/{total_keys}] {title}")
 
         tvdb_id = None
         guid_list = show_data.get("Guid", [])
         for guid_entry in guid_list:
             if isinstance(guid_entry, dict) and 'id' in guid_entry:
                 guid_str = guid_entry['id']
-                match = re.search(r'(?:tvdb|thetvdb)://(\d+)', guid_str)
+                match = _TVDB_GUID_RE.search(guid_str)
                 if match: tvdb_id = match.group(1); break
         if tvdb_id:
             if tvdb_id not in plex_shows:
                 plex_shows[tvdb_id] = {"title": title, "ratingKeys": [], "seasons": {}}
             plex_shows[tvdb_id]["ratingKeys"].append(rating_key)
         else: print(f"Advertencia: No se encontró TVDB ID para '{title}' (RK:{rating_key}, GUID:{primary_guid}). Omitida.")
-    else: print(f"Advertencia: No se obtuvieron metadatos para RK {rating_key}.")
+    return plex_shows
 
 # --- Get Season/Episode Data from Plex ---
-print("\nRecopilando datos de temporadas y episodios desde Plex...")
-count = 0
-total_shows = len(plex_shows)
-for tvdb_id, show_info in plex_shows.items():
-    count += 1
-    if DEBUG_MODE or count % 10 == 0 or count == total_shows:
-        print(f"Procesando Episodios Plex: [{count}/{total_shows}] {show_info['title']}")
-    show_info["seasons"] = {}
-    for rating_key in show_info["ratingKeys"]:
-        episodes_url = f"{PLEX_BASE_URL}/library/metadata/{rating_key}/allLeaves"
-        episodes_response = make_request(episodes_url, headers=PLEX_HEADERS)
-        if episodes_response and "MediaContainer" in episodes_response and "Metadata" in episodes_response["MediaContainer"]:
-            for episode in episodes_response["MediaContainer"]["Metadata"]:
-                season_num_str = episode.get("parentIndex"); episode_num = episode.get("index")
-                episode_title = episode.get("title"); media_type = episode.get("type", "desconocido")
-                if media_type == "episode" and season_num_str is not None and episode_num is not None:
-                    try:
-                        episode_num_int = int(episode_num); season_num_str = str(season_num_str)
-                        if season_num_str not in show_info["seasons"]: show_info["seasons"][season_num_str] = []
-                        found = any(episode_num_int in ep_dict for ep_dict in show_info["seasons"][season_num_str])
-                        if not found: show_info["seasons"][season_num_str].append({episode_num_int: episode_title or "Sin Título"})
-                    except (ValueError, TypeError): print(f"Advertencia: Núm. ep/temp inválido '{show_info['title']}' (RK:{rating_key}) S:{season_num_str} E:{episode_num}.")
-        else: print(f"Advertencia: No se obtuvieron episodios para '{show_info['title']}' (RK:{rating_key}).")
-
+def fetch_plex_episodes(plex_shows):
+    """Rellena show_info["seasons"] de cada serie con los números y títulos normalizados de sus episodios."""
+    print("\nRecopilando datos de temporadas y episodios desde Plex...")
+    count = 0
+    total_shows = len(plex_shows)
+    leaves_keys = [rating_key for show_info in plex_shows.values() for rating_key in show_info["ratingKeys"]]
+    leaves_urls = [f"{PLEX_BASE_URL}/library/metadata/{rating_key}/allLeaves" for rating_key in leaves_keys]
+    episodes_by_rating_key = dict(zip(leaves_keys, fetch_all(leaves_urls, PLEX_MAX_WORKERS)))
+    for tvdb_id, show_info in plex_shows.items():
+        count += 1
+        if DEBUG_MODE or count % 10 == 0 or count == total_shows:
+            print(f"Procesando Episodios Plex: [{count}/{total_shows}] {show_info['title']}")
+        seasons = show_info["seasons"] = {}
+        for rating_key in show_info["ratingKeys"]:
+            episodes_response = episodes_by_rating_key.get(rating_key)
+            if episodes_response and "MediaContainer" in episodes_response and "Metadata" in episodes_response["MediaContainer"]:
+                for episode in episodes_response["MediaContainer"]["Metadata"]:
+                    season_num_str = episode.get("parentIndex"); episode_num = episode.get("index")
+                    episode_title = episode.get("title"); media_type = episode.get("type", "desconocido")
+                    if media_type == "episode" and season_num_str is not None and episode_num is not None:
+                        try:
+                            episode_num_int = int(episode_num); season_num_str = str(season_num_str)
+                            # Por temporada: conjunto de números y conjunto de títulos normalizados (búsquedas O(1) al comparar)
+                            season = seasons.get(season_num_str)
+                            if season is None: season = seasons[season_num_str] = {"nums": set(), "names": set()}
+                            season_nums = season["nums"]
+                            if episode_num_int not in season_nums:
+                                season_nums.add(episode_num_int); season["names"].add(_norm_title(episode_title or "Sin Título"))
+                        except (ValueError, TypeError): print(f"Advertencia: Núm. ep/temp inválido '{show_info['title']}' (RK:{rating_key}) S:{season_num_str} E:{episode_num}.")
+            else: print(f"Advertencia: No se obtuvieron episodios para '{show_info['title']}' (RK:{rating_key}).")
+
+# --- Per-Show Season Summary ---
+def print_show_summary(show_title, plex_seasons, tvdb_episode_counts):
+    """Imprime (de una sola vez) el recuento Plex vs TVDB por temporada de una serie."""
+    # Se acumulan las líneas y se escriben de una sola vez por serie
+    summary_lines = [f"  Resumen '{show_title}':"]
+    plex_episode_counts = { s: len(e["nums"]) for s, e in plex_seasons.items() if s != '0' }
+    all_season_keys_str = plex_episode_counts.keys() | tvdb_episode_counts.keys()
+    sorted_season_keys_int = []
+    try: sorted_season_keys_int = sorted(int(k) for k in all_season_keys_str)
+    except ValueError:
+         summary_lines.append(f"    Advertencia: Claves de temporada no numéricas para '{show_title}'. Ordenando texto.")
+         sorted_season_keys_str = sorted(all_season_keys_str)
+         for season_key_str in sorted_season_keys_str:
+             plex_count = plex_episode_counts.get(season_key_str, 0); tvdb_count = tvdb_episode_counts[season_key_str]
+             status = "OK" if plex_count >= tvdb_count else ("FALTAN" if plex_count < tvdb_count else "Solo Plex?")
+             summary_lines.append(f"    Temporada {season_key_str:>2}: Plex ({plex_count:>3}), TVDB ({tvdb_count:>3}) [{status}]")
+    for season_num_int in sorted_season_keys_int:
+        season_key_str = str(season_num_int)
+        plex_count = plex_episode_counts.get(season_key_str, 0); tvdb_count = tvdb_episode_counts[season_key_str]
+        status = "OK" if plex_count >= tvdb_count else ("FALTAN" if plex_count < tvdb_count else "Solo Plex?")
+        summary_lines.append(f"    Temporada {season_num_int:02d}: Plex ({plex_count:>3}), TVDB ({tvdb_count:>3}) [{status}]")
+    sys.stdout.write("\n".join(summary_lines) + "\n")
 
 # --- Compare with TheTVDB API v4 (using /extended) ---
-print("\nComparando con TheTVDB API v4 y buscando episodios faltantes...")
-missing_episodes_by_show = {}
-count = 0
-total_shows_to_compare = len(plex_shows)
-for tvdb_id, show_info in plex_shows.items():
-    count += 1
+def compare_show(tvdb_id, show_info, tvdb_response, missing_episodes_by_show):
+    """Compara una serie de Plex con su respuesta de TVDB /extended y acumula sus faltantes."""
     show_title = show_info['title']
-    print(f"Verificando TVDB v4 (Extended): [{count}/{total_shows_to_compare}] {show_title} (ID: {tvdb_id})")
-
     all_tvdb_episodes = []
-    tvdb_extended_url = f"{TVDB_API_BASE_URL}/series/{tvdb_id}/extended"
-    params = {"meta": "episodes"}
-    tvdb_response = make_request(tvdb_extended_url, headers=TVDB_HEADERS, params=params, is_tvdb=True)
 
     if tvdb_response and isinstance(tvdb_response, dict) and "data" in tvdb_response:
         series_data = tvdb_response.get("data")
@@ -227,113 +440,106 @@ for tvdb_id, show_info in plex_shows.items():
     else: print(f"Advertencia: No se pudo obtener respuesta válida de TVDB /extended para '{show_title}' (ID:{tvdb_id}).")
     # all_tvdb_episodes permanecerá [] si hubo error
 
+    # Una sola pasada: episodios faltantes y recuento de emitidos por temporada
+    missing, tvdb_episode_counts = find_missing_episodes(show_title, show_info.get("seasons", {}), all_tvdb_episodes)
+    if missing: missing_episodes_by_show.setdefault(show_title, []).extend(missing)
+
     # Resumen de Episodios (Modo No-Debug)
     if not DEBUG_MODE and all_tvdb_episodes:
-        print(f"  Resumen '{show_title}':")
-        # ... (código del resumen igual) ...
-        plex_seasons_data = show_info.get("seasons", {})
-        plex_episode_counts = { s: len(e) for s, e in plex_seasons_data.items() if s != '0' }
-        tvdb_episode_counts = defaultdict(int)
-        for ep in all_tvdb_episodes:
-             if not isinstance(ep, dict): continue
-             tvdb_season_num = ep.get("seasonNumber"); tvdb_episode_num = ep.get("number"); aired_str = ep.get("aired")
-             if tvdb_season_num is None or tvdb_season_num == 0 or tvdb_episode_num is None: continue
-             if not aired_str: continue
-             try:
-                 aired_date = datetime.strptime(aired_str, "%Y-%m-%d").date()
-                 if aired_date >= (datetime.now().date() - timedelta(days=1)): continue
-             except ValueError: continue
-             season_str = str(tvdb_season_num)
-             tvdb_episode_counts[season_str] += 1
-        all_season_keys_str = set(plex_episode_counts.keys()) | set(tvdb_episode_counts.keys())
-        sorted_season_keys_int = []
-        try: sorted_season_keys_int = sorted([int(k) for k in all_season_keys_str])
-        except ValueError:
-             print(f"    Advertencia: Claves de temporada no numéricas para '{show_title}'. Ordenando texto.")
-             sorted_season_keys_str = sorted(list(all_season_keys_str))
-             for season_key_str in sorted_season_keys_str:
-                 plex_count = plex_episode_counts.get(season_key_str, 0); tvdb_count = tvdb_episode_counts[season_key_str]
-                 status = "OK" if plex_count >= tvdb_count else ("FALTAN" if plex_count < tvdb_count else "Solo Plex?")
-                 print(f"    Temporada {season_key_str:>2}: Plex ({plex_count:>3}), TVDB ({tvdb_count:>3}) [{status}]")
-        for season_num_int in sorted_season_keys_int:
-            season_key_str = str(season_num_int)
-            plex_count = plex_episode_counts.get(season_key_str, 0); tvdb_count = tvdb_episode_counts[season_key_str]
-            status = "OK" if plex_count >= tvdb_count else ("FALTAN" if plex_count < tvdb_count else "Solo Plex?")
-            print(f"    Temporada {season_num_int:02d}: Plex ({plex_count:>3}), TVDB ({tvdb_count:>3}) [{status}]")
-
-
-    # Bucle para encontrar episodios específicamente faltantes
-    for tvdb_episode in all_tvdb_episodes:
-        if not isinstance(tvdb_episode, dict): continue
-        try:
-            # ... (lógica interna de comparación igual) ...
-            tvdb_season_num = tvdb_episode.get("seasonNumber"); tvdb_episode_num = tvdb_episode.get("number")
-            tvdb_episode_name = tvdb_episode.get("name"); aired_str = tvdb_episode.get("aired")
-            if tvdb_season_num is None or tvdb_season_num == 0 or tvdb_episode_num is None: continue
-            if not aired_str: continue
-            try:
-                aired_date = datetime.strptime(aired_str, "%Y-%m-%d").date()
-                if aired_date >= (datetime.now().date() - timedelta(days=1)): continue
-            except ValueError: continue
-            tvdb_season_num_str = str(tvdb_season_num)
-            plex_episodes_in_season = show_info.get("seasons", {}).get(tvdb_season_num_str, [])
-            plex_episode_numbers = set(num for ep_dict in plex_episodes_in_season for num in ep_dict.keys())
-            plex_episode_names = set(name for ep_dict in plex_episodes_in_season for name in ep_dict.values())
-            try: tvdb_episode_num_int = int(tvdb_episode_num)
-            except (ValueError, TypeError): continue
-            found_by_number = tvdb_episode_num_int in plex_episode_numbers
-            found_by_name = tvdb_episode_name is not None and tvdb_episode_name in plex_episode_names
-            is_missing = not found_by_number and not found_by_name
-            if is_missing:
-                if show_title not in missing_episodes_by_show: missing_episodes_by_show[show_title] = []
-                missing_episodes_by_show[show_title].append({
-                    "season": tvdb_season_num_str, "episode": str(tvdb_episode_num_int),
-                    "name": tvdb_episode_name or "Nombre Desconocido"
-                })
-        except Exception as e:
-            print(f"Error inesperado procesando episodio TVDB '{show_title}': {tvdb_episode}\nError: {e}")
-            continue
-
+        print_show_summary(show_title, show_info.get("seasons", {}), tvdb_episode_counts)
+
+def compare_with_tvdb(plex_shows):
+    """Descarga los episodios de TVDB de cada serie y devuelve show_title -> lista de episodios faltantes.
+    Cada serie se compara en cuanto llega su respuesta, sin esperar a que terminen las más lentas."""
+    print("\nComparando con TheTVDB API v4 y buscando episodios faltantes...")
+    missing_episodes_by_show = {}
+    count = 0
+    total_shows_to_compare = len(plex_shows)
+    if not plex_shows: return missing_episodes_by_show
+    with ThreadPoolExecutor(max_workers=min(TVDB_MAX_WORKERS, total_shows_to_compare)) as executor:
+        futures = {executor.submit(fetch_tvdb_extended, tvdb_id): tvdb_id for tvdb_id in plex_shows}
+        for future in as_completed(futures):
+            count += 1
+            tvdb_id = futures[future]; show_info = plex_shows[tvdb_id]
+            print(f"Verificando TVDB v4 (Extended): [{count}/{total_shows_to_compare}] {show_info['title']} (ID: {tvdb_id})")
+            compare_show(tvdb_id, show_info, future.result(), missing_episodes_by_show)
+    save_tvdb_cache(TVDB_CACHE_FILE, TVDB_CACHE)
+    return missing_episodes_by_show
 
 # --- Imprimir Lista Detallada de Faltantes ---
-if missing_episodes_by_show:
-    print("\n--- Lista Detallada de Episodios Faltantes ---")
-    # ... (código igual) ...
-    for show_title in sorted(missing_episodes_by_show.keys()):
-        print(f"\n{show_title}:")
+def write_missing_list(out, missing_episodes_by_show):
+    if not missing_episodes_by_show:
+        out.write("\n--- ¡No se encontraron episodios faltantes! ---\n")
+        return
+    out.write("\n--- Lista Detallada de Episodios Faltantes ---\n")
+    for show_title in sorted(missing_episodes_by_show):
+        out.write(f"\n{show_title}:\n")
         missing_list = missing_episodes_by_show[show_title]
         try: missing_list.sort(key=lambda x: (int(x['season']), int(x['episode'])))
         except ValueError: missing_list.sort(key=lambda x: (x['season'], x['episode']))
         for episode in missing_list:
             try:
                 s_num = int(episode['season']); e_num = int(episode['episode'])
-                print(f"  S{s_num:02d}E{e_num:02d} - {episode['name']}")
-            except (ValueError, TypeError): print(f"  Season {episode['season']} Episode {episode['episode']} - {episode['name']} (Error formato)")
-
-else:
-     print("\n--- ¡No se encontraron episodios faltantes! ---")
-
+                out.write(f"  S{s_num:02d}E{e_num:02d} - {episode['name']}\n")
+            except (ValueError, TypeError): out.write(f"  Season {episode['season']} Episode {episode['episode']} - {episode['name']} (Error formato)\n")
 
 # --- Resumen Final de Episodios Faltantes por Temporada ---
-if missing_episodes_by_show:
-    print("\n--- Resumen de Episodios Faltantes por Temporada ---")
-    missing_counts = defaultdict(lambda: defaultdict(int))
-    for show_title, missing_list in missing_episodes_by_show.items():
-        for episode in missing_list:
-            season = episode['season']
-            missing_counts[show_title][season] += 1
-    for show_title in sorted(missing_counts.keys()):
-        print(f"\n{show_title}:")
+def write_missing_summary(out, missing_episodes_by_show):
+    if not missing_episodes_by_show: return
+    out.write("\n--- Resumen de Episodios Faltantes por Temporada ---\n")
+    missing_counts = {show_title: Counter(episode['season'] for episode in missing_list)
+                      for show_title, missing_list in missing_episodes_by_show.items()}
+    for show_title in sorted(missing_counts):
+        out.write(f"\n{show_title}:\n")
         seasons_sorted = []
-        try: seasons_sorted = sorted(missing_counts[show_title].keys(), key=int)
+        try: seasons_sorted = sorted(missing_counts[show_title], key=int)
         except ValueError:
-            print("  Advertencia: Claves de temporada no numéricas. Ordenando texto.")
-            seasons_sorted = sorted(missing_counts[show_title].keys())
+            out.write("  Advertencia: Claves de temporada no numéricas. Ordenando texto.\n")
+            seasons_sorted = sorted(missing_counts[show_title])
         for season in seasons_sorted:
             count = missing_counts[show_title][season]
             try: season_formatted = f"Temporada {int(season):02d}"
             except ValueError: season_formatted = f"Temporada {season}"
-            print(f"  {season_formatted}: {count} episodio{'s' if count > 1 else ''} faltante{'s' if count > 1 else ''}")
+            out.write(f"  {season_formatted}: {count} episodio{'s' if count > 1 else ''} faltante{'s' if count > 1 else ''}\n")
 
+def print_report(missing_episodes_by_show):
+    """Formatea la lista detallada y el resumen en memoria y los escribe en stdout de una sola vez."""
+    buf = io.StringIO()
+    write_missing_list(buf, missing_episodes_by_show)
+    write_missing_summary(buf, missing_episodes_by_show)
+    sys.stdout.write(buf.getvalue())
 
-print("\n--- Proceso Completado ---")
+def save_missing_json(path, missing_episodes_by_show):
+    """Guarda los faltantes en JSON (show_title -> [{season, episode, name}]) para otras herramientas."""
+    try:
+        if orjson is not None:
+            with open(path, 'wb') as f: f.write(orjson.dumps(missing_episodes_by_show, option=orjson.OPT_INDENT_2))
+        else:
+            with open(path, 'w', encoding='utf-8') as f: json.dump(missing_episodes_by_show, f, ensure_ascii=False, indent=2)
+    except OSError as e: print(f"Advertencia: No se pudo guardar {path}: {e}")
+
+# --- Main ---
+def main():
+    global TVDB_CACHE
+    parser = argparse.ArgumentParser(description='Busca episodios de TV faltantes en Plex comparando con TheTVDB API v4.')
+    parser.add_argument('-d', '--debug', action='store_true', help='Activa el modo de depuración.')
+    args = parser.parse_args()
+
+    load_config(args.debug)
+    init_sessions()
+    TVDB_CACHE = load_tvdb_cache(TVDB_CACHE_FILE)
+    tvdb_login()
+
+    tv_keys = get_tv_section_keys()
+    all_series = get_all_series(tv_keys)
+    plex_shows = extract_tvdb_ids(all_series)
+    fetch_plex_episodes(plex_shows)
+
+    missing_episodes_by_show = compare_with_tvdb(plex_shows)
+    print_report(missing_episodes_by_show)
+    save_missing_json(MISSING_JSON_FILE, missing_episodes_by_show)
+
+    print("\n--- Proceso Completado ---")
+
+if __name__ == "__main__":
+    main()
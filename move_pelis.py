@@ -1,14 +1,28 @@
 import csv
+import errno
 import os
+import platform
 import shutil
+import stat
 import sys
 import argparse
+import logging
+import logging.handlers
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Dict, Any, List
 
+# liburing (opcional, solo Linux) permite enviar en lote los statx() de una carpeta a través de io_uring
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
 # --- Constantes y Configuración ---
 CSV_FILE = "plex_movies_export.csv"
+DRY_RUN_WORKERS = 16 # Hilos para comprobaciones en disco y tamaños (bajar a ~4 en discos mecánicos)
+_YEAR_RE = re.compile(r'\((\d{4})\)') # Año entre paréntesis en el nombre de la carpeta
 
 # Códigos de escape ANSI para colores
 COLOR_RESET = "\033[0m"
@@ -20,6 +34,39 @@ COLOR_CYAN = "\033[96m"
 COLOR_MAGENTA = "\033[95m"
 COLOR_BOLD = "\033[1m"
 
+# --- Salida de Avisos (stderr) ---
+# Los avisos van por logging con argumentos %-style: el mensaje solo se formatea si el nivel lo deja pasar.
+log = logging.getLogger("move_pelis")
+
+class ColorFormatter(logging.Formatter):
+    """Colorea el mensaje según su nivel; sin terminal (salida redirigida) se deja sin códigos ANSI."""
+    LEVEL_COLORS = {logging.WARNING: COLOR_YELLOW, logging.ERROR: COLOR_RED}
+
+    def __init__(self, use_color: bool):
+        super().__init__("%(message)s")
+        self.use_color = use_color
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        color = self.LEVEL_COLORS.get(record.levelno) if self.use_color else None
+        return f"{color}{message}{COLOR_RESET}" if color else message
+
+def setup_logging(quiet: bool) -> None:
+    """Configura los avisos en stderr. Con `quiet` solo se muestran los errores."""
+    is_tty = sys.stderr.isatty()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(ColorFormatter(use_color=is_tty))
+    # Sin terminal se escriben en bloques de 256 líneas en lugar de una escritura por aviso
+    handler = stream_handler if is_tty else \
+        logging.handlers.MemoryHandler(256, flushLevel=logging.ERROR, target=stream_handler)
+    log.addHandler(handler)
+    log.setLevel(logging.ERROR if quiet else logging.WARNING)
+    log.propagate = False
+
+def flush_log() -> None:
+    """Vuelca los avisos pendientes (antes del resumen, para que no queden detrás)."""
+    for handler in log.handlers: handler.flush()
+
 # --- Funciones de Utilidad ---
 
 def prepare_directory(path_str: str) -> Path:
@@ -38,43 +85,224 @@ def prepare_directory(path_str: str) -> Path:
     except OSError as e:
         raise SystemExit(f"{COLOR_RED}Error al resolver ruta de destino '{path_str}': {e}{COLOR_RESET}")
 
-def count_items_in_directory(directory_path: Path) -> int:
-    """Cuenta los elementos directamente dentro de un directorio."""
-    if not directory_path.is_dir(): return 0
+def count_items_in_directory(directory_path: Path, limit: Optional[int] = None) -> int:
+    """Cuenta los elementos directamente dentro de un directorio.
+    Con `limit` deja de contar al alcanzarlo (basta para saber si se supera un umbral)."""
     try:
-        return len(list(directory_path.iterdir()))
+        count = 0
+        with os.scandir(directory_path) as it:
+            for _ in it:
+                count += 1
+                if limit is not None and count >= limit: break
+        return count
+    except (FileNotFoundError, NotADirectoryError): return 0 # Sin stat() previo: lo detecta el propio scandir
     except OSError as e:
-        print(f"{COLOR_YELLOW}Advertencia: No se pudo contar en '{directory_path}': {e}{COLOR_RESET}", file=sys.stderr)
+        log.warning("Advertencia: No se pudo contar en '%s': %s", directory_path, e)
         return 9999
 
-def get_total_size(path: Path) -> int:
-    """Calcula el tamaño total en bytes de un archivo o directorio (recursivamente)."""
-    if not path.exists(): return 0
-    if path.is_file(): return path.stat().st_size
-    total_size = 0
-    for entry in path.rglob('*'):
-        if entry.is_file():
+def _scandir_recursive(path):
+    """Genera los DirEntry de todos los archivos bajo `path` (sin seguir enlaces simbólicos).
+    DirEntry cachea el tipo de entrada, así que no hace falta un stat() extra por archivo para saberlo."""
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_symlink(): continue
+                if entry.is_file(follow_symlinks=False): yield entry
+                elif entry.is_dir(follow_symlinks=False): yield from _scandir_recursive(entry.path)
+    except OSError as e:
+        log.warning("Advertencia: No se pudo recorrer '%s': %s", path, e)
+
+# --- Backends de E/S para calcular tamaños (--io-method) ---
+class PosixBackend:
+    """Tamaños con os.scandir() + DirEntry.stat(). Se puede usar desde varios hilos a la vez."""
+    name = "posix"
+    thread_safe = True
+
+    def dir_size(self, path: Path) -> int:
+        total_size = 0
+        for entry in _scandir_recursive(path):
             try:
-                total_size += entry.stat().st_size
+                total_size += entry.stat(follow_symlinks=True).st_size
+            except FileNotFoundError: pass # Borrado entre el listado y el stat()
             except OSError as e:
-                print(f"{COLOR_YELLOW}Advertencia: No se pudo obtener tamaño de '{entry}': {e}{COLOR_RESET}", file=sys.stderr)
-    return total_size
+                log.warning("Advertencia: No se pudo obtener tamaño de '%s': %s", entry.path, e)
+        return total_size
+
+    def close(self) -> None:
+        pass
+
+class UringBackend:
+    """Tamaños enviando los statx() de todos los archivos de un directorio en lotes por io_uring.
+    Un anillo no se puede compartir entre hilos, así que se usa solo desde el hilo principal."""
+    name = "uring"
+    thread_safe = False
+    QUEUE_DEPTH = 1024
+
+    def __init__(self):
+        self.ring = liburing.Ring()
+        self.cqe = liburing.Cqe()
+        liburing.io_uring_queue_init(self.QUEUE_DEPTH, self.ring)
+
+    def close(self) -> None:
+        liburing.io_uring_queue_exit(self.ring)
+
+    def dir_size(self, path: Path) -> int:
+        file_paths = [entry.path for entry in _scandir_recursive(path)]
+        total_size = 0
+        for start in range(0, len(file_paths), self.QUEUE_DEPTH):
+            batch = file_paths[start:start + self.QUEUE_DEPTH]
+            buffers = [liburing.Statx() for _ in batch]
+            for index, (file_path, statx_buf) in enumerate(zip(batch, buffers)):
+                sqe = liburing.io_uring_get_sqe(self.ring)
+                liburing.io_uring_prep_statx(sqe, statx_buf, file_path, 0, liburing.STATX_SIZE)
+                sqe.user_data = index
+            liburing.io_uring_submit(self.ring)
+            for _ in batch:
+                liburing.io_uring_wait_cqe(self.ring, self.cqe) # Si la espera falla no hay completion que consumir
+                completion = self.cqe[0]
+                index = completion.user_data # Las completions pueden llegar en otro orden
+                try:
+                    # liburing ya lanza OSError al leer un res < 0; la comprobación cubre versiones que no lo hagan
+                    if completion.res < 0: raise OSError(-completion.res, os.strerror(-completion.res))
+                    total_size += buffers[index].size
+                except FileNotFoundError: pass # Borrado entre el listado y el statx()
+                except OSError as e:
+                    log.warning("Advertencia: No se pudo obtener tamaño de '%s': %s", batch[index], e)
+                liburing.io_uring_cq_advance(self.ring, 1)
+        return total_size
+
+POSIX_BACKEND = PosixBackend()
+
+def _uring_supported() -> bool:
+    """io_uring con IORING_OP_STATX necesita Linux >= 5.6 y el paquete liburing."""
+    if liburing is None or platform.system() != "Linux": return False
+    try:
+        major, minor = (int(part) for part in platform.release().split('.')[:2])
+    except ValueError:
+        return False
+    return (major, minor) >= (5, 6)
+
+def select_io_backend(io_method: str):
+    """Devuelve el backend pedido ('auto', 'posix' o 'uring'), recurriendo a posix si io_uring no está disponible."""
+    if io_method == "posix": return POSIX_BACKEND
+    if not _uring_supported():
+        if io_method == "uring":
+            log.warning("Advertencia: io_uring no disponible (requiere Linux >= 5.6 y 'pip install liburing'); se usará posix.")
+        return POSIX_BACKEND
+    try:
+        return UringBackend()
+    except OSError as e: # p. ej. io_uring deshabilitado por sysctl o por el contenedor
+        if io_method == "uring": log.warning("Advertencia: No se pudo iniciar io_uring (%s); se usará posix.", e)
+        return POSIX_BACKEND
+
+def get_total_size(path: Path, backend=POSIX_BACKEND) -> int:
+    """Calcula el tamaño total en bytes de un archivo o directorio (recursivamente)."""
+    try: st = os.stat(path) # Un solo stat() para existencia, tipo y tamaño
+    except OSError: return 0
+    if not stat.S_ISDIR(st.st_mode): return st.st_size
+    return backend.dir_size(path)
+
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
 
 def format_bytes(size_bytes: int) -> str:
     """Formatea bytes a una cadena legible (KB, MB, GB, TB)."""
     if size_bytes == 0: return "0 B"
-    sizes = ["B", "KB", "MB", "GB", "TB"]
-    i = 0
-    while size_bytes >= 1024 and i < len(sizes) - 1:
-        size_bytes /= 1024; i += 1
-    return f"{size_bytes:.2f} {sizes[i]}"
+    # La unidad sale directamente del número de bits: cada unidad son 10 bits más (1024)
+    i = min((int(size_bytes).bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * i)):.2f} {_SIZE_UNITS[i]}"
 
 def extract_year_from_name(name: str) -> Optional[int]:
     """Extrae un año de 4 dígitos entre paréntesis de una cadena."""
-    match = re.search(r'\((\d{4})\)', name)
-    if match:
-        return int(match.group(1))
-    return None
+    match = _YEAR_RE.search(name)
+    return int(match.group(1)) if match else None
+
+def check_dry_run_target(targets: tuple, backend=POSIX_BACKEND) -> tuple:
+    """Para el dry-run: devuelve (tamaño a mover, si el destino ya existe) de una terna (origen, destino, es_dir)."""
+    move_target, target_path_in_dest, is_dir = targets
+    if is_dir:
+        size = get_total_size(move_target, backend)
+    else:
+        # FILE_ONLY: ya se comprobó que es un archivo, basta un stat()
+        try: size = os.stat(move_target).st_size
+        except OSError: size = 0
+    return size, os.path.lexists(target_path_in_dest)
+
+# Etiquetas de FILE_ONLY según (sin id, más de 3 elementos): solo hay tres combinaciones posibles
+_FILE_ONLY_LOG_TYPES = {
+    (True, False): "FILE_ONLY (sin id)",
+    (False, True): "FILE_ONLY (>3 archivos)",
+    (True, True): "FILE_ONLY (sin id, >3 archivos)",
+}
+
+def plan_move(full_file_path_str: str, source_dir_str: str, dest_dir: Path, dest_abs: str) -> tuple:
+    """Comprobaciones en disco de una película que coincide con el filtro (se ejecuta en varios hilos).
+    Devuelve (motivo_para_saltarla, None) o (None, (origen, destino, es_dir, tipo_de_movimiento))."""
+    if not os.path.isdir(source_dir_str):
+        return f"origen '{source_dir_str}' no encontrado", None
+    try:
+        if _is_subpath(os.path.realpath(source_dir_str), dest_abs):
+            return "ya en destino", None
+    except OSError as e:
+        return f"error al resolver ruta: {e}", None
+
+    # Decidir si mover directorio o solo archivo
+    source_basename = os.path.basename(source_dir_str)
+    num_items = count_items_in_directory(Path(source_dir_str), limit=4) # Solo importa si hay más de 3
+    contains_id = ("imdb" in source_basename.lower() or "tmdb" in source_basename.lower())
+    if not contains_id or num_items > 3:
+        move_log_type = _FILE_ONLY_LOG_TYPES[(not contains_id, num_items > 3)]
+        if not os.path.isfile(full_file_path_str):
+            return f"archivo '{full_file_path_str}' no encontrado", None
+        move_target = Path(full_file_path_str)
+        return None, (move_target, dest_dir / move_target.name, False, move_log_type)
+    return None, (Path(source_dir_str), dest_dir / source_basename, True, "DIR")
+
+def move_item(move_target: Path, target_path_in_dest: Path) -> None:
+    """Mueve un archivo o directorio. Primero intenta os.rename(); si falla por estar en otro
+    sistema de archivos (EXDEV, también entre bind mounts), shutil.move() copia y borra el origen."""
+    try:
+        os.rename(move_target, target_path_in_dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV: raise
+        shutil.move(os.fspath(move_target), os.fspath(target_path_in_dest))
+
+def _is_subpath(child_abs: str, parent_abs: str) -> bool:
+    """Indica si la ruta absoluta `child_abs` es `parent_abs` o está dentro de ella (solo comparación de cadenas)."""
+    if child_abs == parent_abs: return True
+    return child_abs.startswith(parent_abs if parent_abs.endswith(os.sep) else parent_abs + os.sep)
+
+def get_field(row: List[str], index: int, default: str = "") -> str:
+    """Devuelve la columna `index` de una fila del CSV, o `default` si la fila es más corta."""
+    return row[index] if index < len(row) else default
+
+def build_match_function(active_filter: Dict[str, Any], rating_index: int, genres_index: int):
+    """Devuelve match(row, source_dir_str) -> (coincide, motivo) especializada para el filtro activo,
+    para que el bucle de filas no tenga que decidir en cada fila qué tipo de filtro aplicar."""
+    f_type = active_filter['type']
+    if f_type == 'down' or f_type == 'top':
+        threshold = active_filter['threshold']
+        is_down = f_type == 'down'
+        reason = f"{'BAJA' if is_down else 'ALTA'} NOTA"
+        def match_rating(row, source_dir_str):
+            try: rating = float(get_field(row, rating_index, "N/A"))
+            except (ValueError, TypeError): return False, ""
+            return (rating < threshold if is_down else rating > threshold), reason
+        return match_rating
+    if f_type == 'genre':
+        genres = active_filter['genres']
+        def match_genre(row, source_dir_str):
+            raw_genres = get_field(row, genres_index).lower()
+            # La película debe tener TODOS los géneros especificados (lógica 'Y').
+            # Primero una comprobación barata por subcadena; el conjunto solo se construye si la pasa.
+            is_match = bool(raw_genres) and all(g in raw_genres for g in genres) and \
+                       genres.issubset(g.strip() for g in raw_genres.split('#'))
+            return is_match, "GÉNERO"
+        return match_genre
+    start, end = active_filter['start'], active_filter['end']
+    def match_year(row, source_dir_str):
+        movie_year = extract_year_from_name(os.path.basename(source_dir_str))
+        return bool(movie_year and start <= movie_year <= end), "AÑO"
+    return match_year
 
 # --- Función Principal ---
 
@@ -110,7 +338,22 @@ def main():
         '-e', '--execute', action='store_true',
         help="Ejecuta realmente las operaciones de movimiento. Por defecto es modo 'dry-run'."
     )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=DRY_RUN_WORKERS,
+        help=f"Hilos para las comprobaciones en disco y los tamaños del dry-run\n"
+             f"(por defecto: {DRY_RUN_WORKERS}; ~4 en discos mecánicos)"
+    )
+    parser.add_argument(
+        '--io-method', choices=['auto', 'posix', 'uring'], default='auto',
+        help="Cómo calcular los tamaños del dry-run: 'posix' (os.scandir), 'uring' (io_uring, Linux >= 5.6,\n"
+             "requiere 'pip install liburing') o 'auto' (io_uring si está disponible). Por defecto: auto"
+    )
+    parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help="No muestra los avisos (SKIPPED, advertencias); solo los errores."
+    )
     args = parser.parse_args()
+    setup_logging(args.quiet)
 
     # --- Validación de Parámetros Mutuamente Excluyentes ---
     active_filters_count = sum([1 for arg in [args.down, args.top, args.genre, args.year] if arg is not None])
@@ -133,8 +376,9 @@ def main():
     elif args.genre:
         if len(args.genre) < 2: sys.exit(f"{COLOR_RED}Error: -g requiere un directorio y al menos un género.{COLOR_RESET}")
         dest_dir = prepare_directory(args.genre[0])
-        genre_list = [g.lower() for g in args.genre[1:]]
-        active_filter = {'type': 'genre', 'genres': genre_list, 'dest': dest_dir}
+        # Normalizados una sola vez: en el bucle no hay que volver a hacer strip()/lower() de los filtros
+        genre_set = frozenset(g.strip().lower() for g in args.genre[1:])
+        active_filter = {'type': 'genre', 'genres': genre_set, 'dest': dest_dir}
     elif args.year:
         try:
             start_str, end_str = args.year[0].split('-')
@@ -153,7 +397,7 @@ def main():
     print(f"Procesando '{csv_path}' con el siguiente filtro:")
     if active_filter['type'] == 'down': print(f"  {COLOR_BLUE}BAJA NOTA < {active_filter['threshold']} -> {active_filter['dest']}{COLOR_RESET}")
     if active_filter['type'] == 'top': print(f"  {COLOR_BLUE}ALTA NOTA > {active_filter['threshold']} -> {active_filter['dest']}{COLOR_RESET}")
-    if active_filter['type'] == 'genre': print(f"  {COLOR_MAGENTA}GÉNERO con TODOS [{', '.join(active_filter['genres'])}] -> {active_filter['dest']}{COLOR_RESET}")
+    if active_filter['type'] == 'genre': print(f"  {COLOR_MAGENTA}GÉNERO con TODOS [{', '.join(sorted(active_filter['genres']))}] -> {active_filter['dest']}{COLOR_RESET}")
     if active_filter['type'] == 'year': print(f"  {COLOR_MAGENTA}AÑO en [{active_filter['start']}-{active_filter['end']}] -> {active_filter['dest']}{COLOR_RESET}")
     print("---")
 
@@ -161,123 +405,99 @@ def main():
     stats = {'processed': 0, 'matched': 0, 'moved': 0, 'skipped': 0, 'failed': 0}
     total_size_to_move = 0
     conflicts = []
+    dry_run_targets = [] # (origen, destino, es_dir) a medir al final del dry-run
+    candidates = [] # Filas que coinciden: (nombre, motivo, ruta del archivo, carpeta de origen)
+    current_dest_dir = active_filter['dest']
+    # prepare_directory() ya devuelve la ruta resuelta; se calcula una sola vez fuera del bucle
+    current_dest_dir_abs = os.fspath(current_dest_dir)
 
     try:
-        with open(csv_path, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
+        with open(csv_path, mode='r', encoding='utf-8', buffering=1 << 20, newline='') as f:
+            # csv.reader + índices de columna: evita construir un dict por fila como DictReader
+            reader = csv.reader(f)
+            header = next(reader, [])
             required_cols = ["title", "imdb_rating", "file_path", "genres"] 
-            if not all(col in reader.fieldnames for col in required_cols):
+            if not all(col in header for col in required_cols):
                 sys.exit(f"{COLOR_RED}Error: El CSV debe contener las columnas: {', '.join(required_cols)}{COLOR_RESET}")
+            ti, ri, pi, gi = (header.index(col) for col in required_cols)
+            match_fn = build_match_function(active_filter, ri, gi)
 
             for row_num, row in enumerate(reader, start=2):
+                if not row: continue # Línea en blanco (DictReader también las saltaba)
                 stats['processed'] += 1
                 
-                full_file_path_str = row.get("file_path", "")
+                full_file_path_str = get_field(row, pi)
                 if not full_file_path_str:
-                    print(f"{COLOR_YELLOW}Línea {row_num}: SKIPPED (ruta de archivo vacía){COLOR_RESET}", file=sys.stderr)
+                    log.warning("Línea %d: SKIPPED (ruta de archivo vacía)", row_num)
                     stats['skipped'] += 1
                     continue
                 
-                full_file_path = Path(full_file_path_str)
-                source_dir = full_file_path.parent
+                # Cadenas con os.path hasta saber que la fila coincide: no se crean Path para el resto
+                source_dir_str = os.path.dirname(full_file_path_str)
                 
                 # --- Comprobar si la película coincide con el filtro activo ---
-                is_match = False
-                move_reason = ""
-                
-                f_type = active_filter['type']
-                if f_type == 'down' or f_type == 'top':
-                    try:
-                        rating = float(row.get("imdb_rating", "N/A"))
-                        if (f_type == 'down' and rating < active_filter['threshold']) or \
-                           (f_type == 'top' and rating > active_filter['threshold']):
-                            is_match = True
-                            move_reason = f"{'BAJA' if f_type == 'down' else 'ALTA'} NOTA"
-                    except (ValueError, TypeError): pass
-                elif f_type == 'genre':
-                    movie_genres = {g.strip().lower() for g in row.get("genres", "").split('#')}
-                    # La película debe tener TODOS los géneros especificados (lógica 'Y')
-                    if all(g in movie_genres for g in active_filter['genres']):
-                        is_match = True
-                        move_reason = "GÉNERO"
-                elif f_type == 'year':
-                    movie_year = extract_year_from_name(source_dir.name)
-                    if movie_year and active_filter['start'] <= movie_year <= active_filter['end']:
-                        is_match = True
-                        move_reason = "AÑO"
-                
+                is_match, move_reason = match_fn(row, source_dir_str)
                 if not is_match:
                     continue
                 
                 stats['matched'] += 1
-                source_display_name = f"{row.get('title', 'N/A')} ({row.get('imdb_rating', 'N/A')})"
-                current_dest_dir = active_filter['dest']
+                source_display_name = f"{get_field(row, ti, 'N/A')} ({get_field(row, ri, 'N/A')})"
+                candidates.append((source_display_name, move_reason, full_file_path_str, source_dir_str))
 
-                # --- VALIDACIONES Y LÓGICA DE MOVIMIENTO ---
-                if not source_dir.is_dir():
-                    print(f"{COLOR_YELLOW}{source_display_name} [{move_reason}] SKIPPED (origen '{source_dir}' no encontrado){COLOR_RESET}", file=sys.stderr)
+        # --- VALIDACIONES Y LÓGICA DE MOVIMIENTO ---
+        # Las comprobaciones en disco de cada candidata son independientes y esperan sobre todo a E/S:
+        # se reparten entre hilos. Los movimientos se siguen haciendo de uno en uno y en el orden del CSV.
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            plans = executor.map(lambda c: plan_move(c[2], c[3], current_dest_dir, current_dest_dir_abs), candidates)
+            for (source_display_name, move_reason, _, _), (skip_reason, plan) in zip(candidates, plans):
+                if skip_reason:
+                    log.warning("%s [%s] SKIPPED (%s)", source_display_name, move_reason, skip_reason)
                     stats['skipped'] += 1; continue
-                
-                try:
-                    source_dir_abs_str = str(source_dir.resolve()).rstrip(os.sep) + os.sep
-                    current_dest_dir_abs_str = str(current_dest_dir.resolve()).rstrip(os.sep) + os.sep
-                    if source_dir_abs_str.startswith(current_dest_dir_abs_str):
-                        print(f"{COLOR_YELLOW}{source_display_name} [{move_reason}] SKIPPED (ya en destino){COLOR_RESET}", file=sys.stderr)
-                        stats['skipped'] += 1; continue
-                except OSError as e:
-                    print(f"{COLOR_YELLOW}{source_display_name} [{move_reason}] SKIPPED (error al resolver ruta: {e}){COLOR_RESET}", file=sys.stderr)
-                    stats['skipped'] += 1; continue
-                
-                # Decidir si mover directorio o solo archivo
-                source_basename = source_dir.name
-                num_items = count_items_in_directory(source_dir)
-                contains_id = ("imdb" in source_basename.lower() or "tmdb" in source_basename.lower())
-                
-                if not contains_id or num_items > 3:
-                    reasons = []
-                    if not contains_id: reasons.append("sin id")
-                    if num_items > 3: reasons.append(f">{num_items} archivos")
-                    move_log_type = f"FILE_ONLY ({', '.join(reasons)})"
-                    move_target, target_name_in_dest = full_file_path, full_file_path.name
-                    if not move_target.is_file():
-                        print(f"{COLOR_YELLOW}{source_display_name} [{move_reason}] SKIPPED (archivo '{move_target}' no encontrado){COLOR_RESET}", file=sys.stderr)
-                        stats['skipped'] += 1; continue
-                else:
-                    move_log_type = "DIR"
-                    move_target, target_name_in_dest = source_dir, source_basename
+                move_target, target_path_in_dest, move_is_dir, move_log_type = plan
 
-                target_path_in_dest = current_dest_dir / target_name_in_dest
-                
                 # --- Ejecutar o Simular el Movimiento ---
                 if execute_mode:
-                    if target_path_in_dest.exists():
-                        print(f"{COLOR_YELLOW}{source_display_name} [{move_reason}] SKIPPED (destino ya existe en '{target_path_in_dest}'){COLOR_RESET}", file=sys.stderr)
+                    # Un movimiento anterior (p. ej. de su carpeta) puede haberse llevado ya el origen
+                    if not os.path.lexists(move_target):
+                        log.warning("%s [%s] SKIPPED (origen '%s' no encontrado)", source_display_name, move_reason, move_target)
+                        stats['skipped'] += 1; continue
+                    if os.path.lexists(target_path_in_dest):
+                        log.warning("%s [%s] SKIPPED (destino ya existe en '%s')", source_display_name, move_reason, target_path_in_dest)
                         stats['skipped'] += 1; continue
                     
                     try:
-                        shutil.move(str(move_target), str(current_dest_dir))
+                        move_item(move_target, target_path_in_dest)
                         print(f"{COLOR_GREEN}{source_display_name} [{move_reason}] -> {current_dest_dir} OK ({move_log_type}){COLOR_RESET}")
                         stats['moved'] += 1
                     except (shutil.Error, OSError) as e:
-                        print(f"{COLOR_RED}{source_display_name} [{move_reason}] FAILED (error al mover: {e}){COLOR_RESET}", file=sys.stderr)
+                        log.error("%s [%s] FAILED (error al mover: %s)", source_display_name, move_reason, e)
                         stats['failed'] += 1
                 else: # Dry-run mode
-                    try: display_target = move_target.relative_to(Path.cwd())
-                    except ValueError: display_target = move_target
-                    
                     print(f"{COLOR_CYAN}{source_display_name} [{move_reason}] -> {current_dest_dir} DRY-RUN ({move_log_type}){COLOR_RESET}")
-                    
-                    total_size_to_move += get_total_size(move_target)
-                    
-                    if target_path_in_dest.exists():
-                        conflicts.append({'source': str(move_target), 'conflict': str(target_path_in_dest)})
+                    dry_run_targets.append((move_target, target_path_in_dest, move_is_dir))
 
     except FileNotFoundError:
         sys.exit(f"{COLOR_RED}Error: No se pudo abrir el archivo CSV '{csv_path}'.{COLOR_RESET}")
     except Exception as e:
         sys.exit(f"{COLOR_RED}Error inesperado durante el procesamiento: {e}{COLOR_RESET}")
 
+    # Los recorridos de directorio esperan sobre todo a E/S: con posix se lanzan en paralelo;
+    # io_uring ya agrupa los statx() de cada carpeta y su anillo se usa solo desde este hilo.
+    if dry_run_targets:
+        backend = select_io_backend(args.io_method)
+        workers = max(1, args.workers) if backend.thread_safe else 1
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(lambda targets: check_dry_run_target(targets, backend), dry_run_targets)
+                for (move_target, target_path_in_dest, _), (size, conflict) in zip(dry_run_targets, results):
+                    total_size_to_move += size
+                    if conflict:
+                        conflicts.append({'source': str(move_target), 'conflict': str(target_path_in_dest)})
+        finally:
+            backend.close()
+
     # --- Resumen Final ---
+    flush_log()
     print("---")
     print("Proceso completado.")
     print(f"Películas procesadas en CSV: {stats['processed']}")
@@ -9,12 +9,45 @@
 #
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 import xml.etree.ElementTree as ET
 import json
 import re
+import sqlite3
 from colorama import Fore, Style, init
 import argparse
+import atexit
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# RapidFuzz (opcional) calcula la similitud en C++; si no está instalado se usa difflib
+try:
+    from rapidfuzz import fuzz
+    from rapidfuzz.utils import default_process
+except ImportError:
+    fuzz = None
+    from difflib import SequenceMatcher
+
+# orjson (opcional) para leer config.json; si no está se usa json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# lxml (opcional) parsea los listados XML de Plex (decenas de MB en bibliotecas grandes) con libxml2;
+# si no está instalado se usa xml.etree.ElementTree. Ambos comparten la API usada aquí.
+try:
+    from lxml import etree as XML
+    _XML_PARSER = XML.XMLParser(resolve_entities=False, no_network=True)
+    XML_PARSE_ERRORS = (ET.ParseError, XML.XMLSyntaxError)
+except ImportError:
+    XML = ET
+    _XML_PARSER = None
+    XML_PARSE_ERRORS = (ET.ParseError,)
 
 # Inicializar colorama
 init(autoreset=True)
@@ -25,14 +58,74 @@ VERSION = "1.7.8"
 # Nombre del archivo de configuración JSON
 CONFIG_FILE = "config.json"
 LOG_FILE = "rename.log"
+# Caché de metadatos de /library/metadata entre ejecuciones (validada con updatedAt)
+METADATA_CACHE_FILE = "plex_cache.db"
+
+# Expresiones regulares precompiladas (se usan en cada película)
+_YEAR = r'(19\d{2}|20\d{2}|21\d{2}|2200)'
+_RE_IMDB_ID = re.compile(r'(tt\d+)')
+_RE_DIGITS = re.compile(r'(\d+)')
+_RE_WHITESPACE = re.compile(r'\s+')
+_RE_NON_ALNUM = re.compile(r'[\W_]+')
+# Eliminar/sustituir caracteres sueltos es más rápido con str.translate que con una regex
+_SANITIZE_TBL = str.maketrans('', '', ':\\/*?"<>|')
+_DOT_TBL = str.maketrans('.', ' ')
+# Se mantiene como regex: una sola búsqueda en C es ~2.5x más rápida que partir el nombre
+# en palabras y mirar cada una en un set de años válidos
+_RE_YEAR_IN_FILENAME = re.compile(r'\b' + _YEAR + r'\b')
+_RE_TMDB_EXPLICIT = re.compile(r'(?:tmdbid\s*=\s*|tmdb-)(\d+)', re.IGNORECASE)
+# Una sola búsqueda detecta TMDB en el nombre: grupo 1 con el ID si es explícito, vacío si solo aparece la etiqueta
+_RE_TMDB = re.compile(r'(?:tmdbid\s*=\s*|tmdb-)(\d+)|tmdbid|tmdb-', re.IGNORECASE)
+_RE_ID_TAG = re.compile(r'\{(?:imdb-tt|tmdb-)\d+\}', re.IGNORECASE)
+
+def _words_trie_pattern(words):
+    """Alternancia de palabras factorizada por prefijos: 'x26(?:4|5)' en vez de 'x264|x265'.
+
+    El motor de re no optimiza alternancias de literales; con el trie descarta en el primer
+    carácter las ramas que no aplican. En cada nodo se prueba antes la continuación más larga.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word.lower(): node = node.setdefault(ch, {})
+        node[''] = True # Fin de palabra
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches: return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + body + ')?' if '' in node else body
+    return build(trie)
+
+def build_basename_regex(words):
+    """Une en una sola alternancia todo lo que extract_basename elimina del nombre.
+
+    Cada rama empieza por un carácter distinto ('[', '(' o límite de palabra) para que
+    el motor descarte rápido las que no aplican. Prioridad: [corchetes], (año) antes que
+    otros (paréntesis), y por último años sueltos y palabras de WORDS_TO_REMOVE.
+    Solo (año) marca un grupo con nombre: se sustituye por espacio, el resto por nada.
+    """
+    words = [w for w in words if w]
+    words_branch = r'|(?:' + _words_trie_pattern(words) + r')\b' if words else ''
+    return re.compile(r'\[.*?\]'
+                      r'|\((?:' + _YEAR + r'\)(?P<paren_year>)|.*?\))'
+                      r'|\b(?:' + _YEAR + r'\b' + words_branch + r')', re.IGNORECASE)
+
+def _basename_replacement(match_obj):
+    return ' ' if match_obj.lastgroup else ''
 
 # Variables de configuración globales (se llenarán desde verify_and_load_config)
 PLEX_BASE_URL = ""
 PLEX_TOKEN = ""
 WORDS_TO_REMOVE = []
+_BASENAME_RE = build_basename_regex(WORDS_TO_REMOVE) # Se reconstruye con las palabras de la configuración
 SIMILARITY_AUTO = 100
 SIMILARITY_ASK = 85
 YEAR_DIFF_AUTO = 1
+PLEX_MAX_WORKERS = 16 # Peticiones de metadatos simultáneas contra el servidor Plex
+PLEX_SESSION = None   # requests.Session compartida (se crea en init_session)
+PLEX_TIMEOUT = 30     # Segundos máximos de espera por petición a Plex
+METADATA_BATCH_SIZE = 20 # ratingKeys por petición a /library/metadata/{k1,k2,...}
+_LOG_FH = None        # Handle de LOG_FILE, abierto una vez en el primer renombrado
 
 # Banner de inicio
 print(f"""
@@ -47,8 +140,8 @@ print(f"""
 # --- (Estas funciones permanecen igual que en v1.7.7) ---
 def load_config_file(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        with open(file_path, 'rb') as f:
+            config = _json_loads(f.read())
         return config
     except FileNotFoundError:
         print(f"{Fore.LIGHTRED_EX}Archivo de configuración {file_path} no encontrado.{Style.RESET_ALL}")
@@ -61,7 +154,7 @@ def load_config_file(file_path):
         return None
 
 def verify_and_load_config(config_data, debug_cli_flag): # debug_cli_flag para el mensaje inicial
-    global PLEX_BASE_URL, PLEX_TOKEN, WORDS_TO_REMOVE, SIMILARITY_AUTO, SIMILARITY_ASK, YEAR_DIFF_AUTO
+    global PLEX_BASE_URL, PLEX_TOKEN, WORDS_TO_REMOVE, _BASENAME_RE, SIMILARITY_AUTO, SIMILARITY_ASK, YEAR_DIFF_AUTO, PLEX_MAX_WORKERS
     try:
         PLEX_BASE_URL = config_data["PLEX_BASE_URL"]
         PLEX_TOKEN = config_data["PLEX_TOKEN"]
@@ -74,6 +167,7 @@ def verify_and_load_config(config_data, debug_cli_flag): # debug_cli_flag para e
         SIMILARITY_AUTO = int(config_data.get("SIMILARITY_THRESHOLD_AUTO", 100))
         SIMILARITY_ASK = int(config_data.get("SIMILARITY_THRESHOLD_ASK", 85))
         YEAR_DIFF_AUTO = int(config_data.get("YEAR_MATCH_DIFFERENCE_AUTO", 1))
+        PLEX_MAX_WORKERS = max(1, int(config_data.get("PLEX_MAX_WORKERS", PLEX_MAX_WORKERS)))
 
         if not (0 <= SIMILARITY_AUTO <= 100 and 0 <= SIMILARITY_ASK <= 100):
             print(f"{Fore.LIGHTRED_EX}Error: Los umbrales de similitud (SIMILARITY_THRESHOLD_AUTO y SIMILARITY_THRESHOLD_ASK) deben estar entre 0 y 100.{Style.RESET_ALL}")
@@ -83,146 +177,229 @@ def verify_and_load_config(config_data, debug_cli_flag): # debug_cli_flag para e
         if not isinstance(WORDS_TO_REMOVE, list):
             print(f"{Fore.LIGHTRED_EX}Error: WORDS_TO_REMOVE_FROM_FILENAME en config.json debe ser una lista de strings.{Style.RESET_ALL}")
             return False
+        _BASENAME_RE = build_basename_regex(WORDS_TO_REMOVE)
+        _clean_basename.cache_clear()
         if debug_cli_flag:
-            print_debug(f"Configuración cargada (relevante para autorenamer):", debug_cli_flag, "verify_and_load_config")
-            print_debug(f"  PLEX_BASE_URL: {PLEX_BASE_URL}", debug_cli_flag)
-            print_debug(f"  WORDS_TO_REMOVE_FROM_FILENAME: {len(WORDS_TO_REMOVE)} palabras/frases", debug_cli_flag)
-            print_debug(f"  SIMILARITY_THRESHOLD_AUTO: {SIMILARITY_AUTO}%", debug_cli_flag)
-            print_debug(f"  SIMILARITY_THRESHOLD_ASK: {SIMILARITY_ASK}%", debug_cli_flag)
-            print_debug(f"  YEAR_MATCH_DIFFERENCE_AUTO: {YEAR_DIFF_AUTO} año(s)", debug_cli_flag)
+            print_debug("Configuración cargada (relevante para autorenamer):", function_name="verify_and_load_config")
+            print_debug("  PLEX_BASE_URL: %s", PLEX_BASE_URL)
+            print_debug("  WORDS_TO_REMOVE_FROM_FILENAME: %d palabras/frases", len(WORDS_TO_REMOVE))
+            print_debug("  SIMILARITY_THRESHOLD_AUTO: %s%%", SIMILARITY_AUTO)
+            print_debug("  SIMILARITY_THRESHOLD_ASK: %s%%", SIMILARITY_ASK)
+            print_debug("  YEAR_MATCH_DIFFERENCE_AUTO: %s año(s)", YEAR_DIFF_AUTO)
+            print_debug("  PLEX_MAX_WORKERS: %s", PLEX_MAX_WORKERS)
         return True
     except KeyError as e:
         print(f"{Fore.LIGHTRED_EX}Falta la variable requerida '{e}' en el archivo de configuración ({CONFIG_FILE}). Saliendo del programa.{Style.RESET_ALL}")
         return False
     except ValueError:
-        print(f"{Fore.LIGHTRED_EX}Error: Los valores para SIMILARITY_THRESHOLD_AUTO, SIMILARITY_THRESHOLD_ASK, o YEAR_MATCH_DIFFERENCE_AUTO en config.json deben ser números enteros.{Style.RESET_ALL}")
+        print(f"{Fore.LIGHTRED_EX}Error: Los valores para SIMILARITY_THRESHOLD_AUTO, SIMILARITY_THRESHOLD_ASK, YEAR_MATCH_DIFFERENCE_AUTO o PLEX_MAX_WORKERS en config.json deben ser números enteros.{Style.RESET_ALL}")
         return False
 
-def print_debug(message, debug_mode=False, function_name=None):
-    if debug_mode:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if function_name: print(f"{Fore.LIGHTYELLOW_EX}[DEBUG] {timestamp} - {function_name} - {message}{Style.RESET_ALL}")
-        else: print(f"{Fore.LIGHTYELLOW_EX}[DEBUG] {timestamp} - {message}{Style.RESET_ALL}")
-
-def plex_request(url, headers, debug_mode=False):
-    print_debug(f"Petición HTTP: {url}", debug_mode, "plex_request")
+def _print_debug(fmt, *args, function_name=None):
+    # Formato estilo % perezoso: el mensaje solo se construye si el modo debug está activo
+    message = fmt % args if args else fmt
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if function_name: print(f"{Fore.LIGHTYELLOW_EX}[DEBUG] {timestamp} - {function_name} - {message}{Style.RESET_ALL}")
+    else: print(f"{Fore.LIGHTYELLOW_EX}[DEBUG] {timestamp} - {message}{Style.RESET_ALL}")
+
+def _print_debug_noop(fmt, *args, function_name=None):
+    pass
+
+# Sin -d, print_debug no hace nada (ni timestamp ni formateo); set_debug_mode la cambia al arrancar
+print_debug = _print_debug_noop
+
+def set_debug_mode(enabled):
+    global print_debug
+    print_debug = _print_debug if enabled else _print_debug_noop
+
+def init_session():
+    """Crea la sesión HTTP compartida: reutiliza conexiones keep-alive entre peticiones e hilos."""
+    global PLEX_SESSION
+    # pool_maxsize >= hilos simultáneos para que ningún hilo abra (y descarte) conexiones fuera del pool
+    PLEX_SESSION = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(32, PLEX_MAX_WORKERS),
+                          max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]))
+    PLEX_SESSION.mount("http://", adapter); PLEX_SESSION.mount("https://", adapter)
+    PLEX_SESSION.headers["X-Plex-Token"] = PLEX_TOKEN # El token va en la sesión: las peticiones solo llevan la URL
+
+def plex_request(url):
+    print_debug("Petición HTTP: %s", url, function_name="plex_request")
+    if PLEX_SESSION is None: init_session()
     try:
-        response = requests.get(url, headers=headers)
+        response = PLEX_SESSION.get(url, timeout=PLEX_TIMEOUT)
         response.raise_for_status()
-        response.encoding = response.apparent_encoding if response.apparent_encoding else 'utf-8'
-        return ET.fromstring(response.content)
+        # Se parsean los bytes (el XML declara su codificación): no hace falta apparent_encoding,
+        # que ejecutaba la detección de charset sobre toda la respuesta en cada petición
+        return XML.fromstring(response.content, _XML_PARSER)
     except requests.exceptions.RequestException as e:
         print(f"{Fore.LIGHTRED_EX}Error en petición a Plex API: {e}{Style.RESET_ALL}")
         return None
-    except ET.ParseError as e:
+    except XML_PARSE_ERRORS as e:
         print(f"{Fore.LIGHTRED_EX}Error al parsear XML de Plex API: {e}{Style.RESET_ALL}")
-        print_debug(f"Contenido recibido (primeros 500 chars): {response.text[:500]}", debug_mode, "plex_request")
+        # Solo en modo debug: response.text decodificaría (y detectaría la codificación de) la respuesta entera
+        if print_debug is not _print_debug_noop:
+            print_debug("Contenido recibido (primeros 500 bytes): %s", response.content[:500].decode('utf-8', 'replace'), function_name="plex_request")
         return None
 
-def fetch_plex_sections(debug_mode=False):
-    url = f"{PLEX_BASE_URL}/library/sections"; headers = {"X-Plex-Token": PLEX_TOKEN}
-    return plex_request(url, headers, debug_mode)
+def plex_request_stream(url, tag):
+    """Parsea la respuesta con iterparse a medida que se descarga y va devolviendo cada <tag>
+    completo, ya separado del árbol (el documento entero nunca está en memoria).
+    Los errores de red o de XML se propagan al llamador; los de urllib3 al leer response.raw
+    (conexión cortada, timeout de lectura) llegan como requests.exceptions.ConnectionError."""
+    print_debug("Petición HTTP (streaming): %s", url, function_name="plex_request_stream")
+    if PLEX_SESSION is None: init_session()
+    with PLEX_SESSION.get(url, stream=True, timeout=PLEX_TIMEOUT) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True # Descomprimir gzip/deflate al leer del socket
+        open_elements = []
+        iterparse_options = {"resolve_entities": False, "no_network": True} if XML is not ET else {}
+        try:
+            for event, elem in XML.iterparse(response.raw, events=("start", "end"), **iterparse_options):
+                if event == "start":
+                    open_elements.append(elem)
+                    continue
+                open_elements.pop()
+                if elem.tag == tag:
+                    if open_elements: open_elements[-1].remove(elem)
+                    yield elem
+        except Urllib3HTTPError as e:
+            raise requests.exceptions.ConnectionError(e, response=response) from e
+
+def fetch_plex_sections():
+    return plex_request(f"{PLEX_BASE_URL}/library/sections")
+
+def fetch_plex_movies(section_id):
+    # includeGuids=1 incluye los <Guid> de cada película en el listado; así la mayoría no necesita /library/metadata
+    # Devuelve un generador de <Video>; el listado puede ocupar decenas de MB en bibliotecas grandes
+    return plex_request_stream(f"{PLEX_BASE_URL}/library/sections/{section_id}/all?includeGuids=1", "Video")
+
+def video_node(metadata_xml):
+    # Acepta tanto la respuesta de /library/metadata (MediaContainer) como un <Video> del listado de la sección.
+    # En la respuesta el <Video> es hijo directo: find("Video") no recorre Media/Part como ".//Video"
+    if metadata_xml.tag == "Video": return metadata_xml
+    node = metadata_xml.find("Video")
+    return node if node is not None else metadata_xml.find(".//Video")
+
+def open_metadata_cache(path=METADATA_CACHE_FILE):
+    """Abre (o crea) la caché SQLite de metadatos. Devuelve None si no se puede usar."""
+    try:
+        cache = sqlite3.connect(path)
+        cache.execute("CREATE TABLE IF NOT EXISTS metadata (rating_key TEXT PRIMARY KEY, updated_at TEXT,"
+                      " imdb TEXT, tmdb TEXT, title TEXT, year TEXT)")
+        return cache
+    except sqlite3.Error as e:
+        print(f"{Fore.LIGHTYELLOW_EX}Advertencia: no se pudo abrir la caché de metadatos {path}: {e}{Style.RESET_ALL}")
+        return None
 
-def fetch_plex_movies(section_id, debug_mode=False):
-    url = f"{PLEX_BASE_URL}/library/sections/{section_id}/all"; headers = {"X-Plex-Token": PLEX_TOKEN}
-    return plex_request(url, headers, debug_mode)
+def load_cached_metadata(cache, video):
+    # Reconstruye un <Video> con sus <Guid> si la entrada de la caché coincide con el updatedAt actual
+    updated_at = video.get("updatedAt")
+    if cache is None or not updated_at: return None
+    row = cache.execute("SELECT imdb, tmdb, title, year FROM metadata WHERE rating_key = ? AND updated_at = ?",
+                        (video.get("ratingKey"), updated_at)).fetchone()
+    if row is None: return None
+    imdb_id, tmdb_id, title, year = row
+    cached_video = ET.Element("Video", {k: v for k, v in (("title", title), ("year", year)) if v is not None})
+    if imdb_id: ET.SubElement(cached_video, "Guid", id=f"imdb://{imdb_id}")
+    if tmdb_id: ET.SubElement(cached_video, "Guid", id=f"tmdb://{tmdb_id}")
+    return cached_video
+
+def store_cached_metadata(cache, video, metadata_xml):
+    updated_at = video.get("updatedAt")
+    if cache is None or not updated_at: return
+    node = video_node(metadata_xml) # Un solo find(): get_identifiers recibe ya el <Video>
+    imdb_id, tmdb_id = get_identifiers(node) if node is not None else (None, None)
+    title, year = (node.get("title"), node.get("year")) if node is not None else (None, None)
+    cache.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+                  (video.get("ratingKey"), updated_at, imdb_id, tmdb_id, title, year))
 
 def get_identifiers(metadata_xml):
-    ids_found = {"imdb": None, "tmdb": None}
-    for guid in metadata_xml.findall(".//Guid"):
+    imdb_id = tmdb_id = None
+    video_el = video_node(metadata_xml)
+    if video_el is None: return None, None
+    # Los <Guid> son hijos directos del <Video>: iterfind sin ".//" no recorre Media/Part
+    for guid in video_el.iterfind("Guid"):
         guid_id = guid.get("id", "")
         if "imdb" in guid_id:
-            match_imdb = re.search(r'(tt\d+)', guid_id);
-            if match_imdb: ids_found["imdb"] = match_imdb.group(1)
+            match_imdb = _RE_IMDB_ID.search(guid_id)
+            if match_imdb: imdb_id = match_imdb.group(1)
         elif "tmdb" in guid_id:
-            match_tmdb = re.search(r'(\d+)', guid_id);
-            if match_tmdb: ids_found["tmdb"] = match_tmdb.group(1)
-    return ids_found["imdb"], ids_found["tmdb"]
+            match_tmdb = _RE_DIGITS.search(guid_id)
+            if match_tmdb: tmdb_id = match_tmdb.group(1)
+        if imdb_id and tmdb_id: break # Plex da un <Guid> por proveedor: el resto (tvdb...) no hace falta mirarlo
+    return imdb_id, tmdb_id
 
+@lru_cache(maxsize=4096)
 def sanitize_filename(name):
-    name = re.sub(r'[:\\/*?"<>|]', '', name); name = re.sub(r'\s+', ' ', name).strip()
-    return name
+    # translate quita los caracteres prohibidos y split/join colapsa espacios y recorta en una sola pasada
+    return " ".join(name.translate(_SANITIZE_TBL).split())
 
 def extract_year_from_filename(filename_str): # Renombrado para claridad filename -> filename_str
     # Esta función se usa para obtener el año del NOMBRE DE ARCHIVO ORIGINAL para year_match
     # No debe confundirse con la limpieza de extract_basename
-    match = re.search(r"\b(19\d{2}|20\d{2}|21\d{2}|2200)\b", filename_str)
+    match = _RE_YEAR_IN_FILENAME.search(filename_str)
     if match: return int(match.group(1))
     return None
 
 def extract_basename(file_path):
-    base_name_ext = os.path.basename(file_path)
-    name = os.path.splitext(base_name_ext)[0]
+    return _clean_basename(os.path.splitext(os.path.basename(file_path))[0])
 
-    # 1. Eliminar todo entre corchetes []
-    name = re.sub(r'\[.*?\]', '', name)
+@lru_cache(maxsize=8192)
+def _clean_basename(stem):
+    # Depende de _BASENAME_RE: verify_and_load_config vacía la caché al cambiar WORDS_TO_REMOVE
+    # Una sola pasada elimina [corchetes], (paréntesis), años sueltos y WORDS_TO_REMOVE.
+    # El (año) también se quita (v1.7.8): el año se compara por separado.
+    # Los puntos se cambian después, para que palabras como "5.1" ya se hayan eliminado.
+    name = _BASENAME_RE.sub(_basename_replacement, stem).translate(_DOT_TBL)
+    name = _RE_WHITESPACE.sub(' ', name).strip()
 
-    # 2. Eliminar palabras específicas de la configuración (WORDS_TO_REMOVE)
-    if WORDS_TO_REMOVE:
-        for word in WORDS_TO_REMOVE:
-            name = re.sub(r'\b' + re.escape(word) + r'\b', '', name, flags=re.IGNORECASE)
+    return name if name else stem
 
-    # 3. Manejar paréntesis: temporalmente reemplazar (año) con placeholder, eliminar otros paréntesis.
-    years_in_parens_placeholders = {} # Guardará placeholder -> (año original)
-    placeholder_base = "___YEAR_PLACEHOLDER___"
-    
-    def replace_year_in_paren(match_obj):
-        nonlocal years_in_parens_placeholders # Python 3
-        content_inside_paren = match_obj.group(1)
-        # Verificar si el contenido ES SOLO un año
-        year_match_inside_paren = re.fullmatch(r'(19\d{2}|20\d{2}|21\d{2}|2200)', content_inside_paren)
-        if year_match_inside_paren:
-            year_str = year_match_inside_paren.group(1)
-            placeholder = f"{placeholder_base}{len(years_in_parens_placeholders)}"
-            years_in_parens_placeholders[placeholder] = f"({year_str})" # Guardar el (año) original
-            return placeholder # Reemplazar con placeholder
-        return match_obj.group(0) # Devolver el paréntesis original y su contenido si no es solo un año
-
-    name = re.sub(r'\((.*?)\)', replace_year_in_paren, name)
-    # Ahora, eliminar cualquier paréntesis que no haya sido convertido a placeholder
-    name = re.sub(r'\(.*?\)', '', name)
-
-    # 4. Eliminar años de 4 dígitos que NO están (ni estuvieron) entre paréntesis.
-    #    (Esta lógica es de v1.7.7)
-    name = re.sub(r'(?<!\()\b(19\d{2}|20\d{2}|21\d{2}|2200)\b(?!\))', '', name).strip()
-    
-    # 5. Restaurar los (años) de los placeholders para una limpieza intermedia.
-    #    En este punto, name podría ser "Título ___YEAR_PLACEHOLDER___0"
-    for placeholder, original_year_in_paren in years_in_parens_placeholders.items():
-        name = name.replace(placeholder, original_year_in_paren)
-    #    Ahora name podría ser "Título (1999)"
-
-    # 6. MODIFICACIÓN v1.7.8: Eliminar los patrones (año) del resultado final.
-    #    Esto se hace después de que los (años) hayan sido restaurados,
-    #    para asegurar que eliminamos específicamente esos.
-    name = re.sub(r'\s*\((19\d{2}|20\d{2}|21\d{2}|2200)\)\s*', ' ', name).strip()
-    #   \s* -> cero o más espacios
-    #   \(   -> paréntesis abierto literal
-    #   (AÑO) -> captura el año
-    #   \)   -> paréntesis cerrado literal
-    #   \s* -> cero o más espacios
-    #   Reemplaza con un solo espacio para evitar unir palabras, luego .strip() lo maneja.
-
-    # 7. Limpieza final: reemplazar puntos con espacios, normalizar espacios.
-    name = name.replace('.', ' ').strip()
-    name = re.sub(r'\s+', ' ', name).strip()
-
-    return name if name else os.path.splitext(base_name_ext)[0]
 
+def _ratio(a, b):
+    return SequenceMatcher(None, a, b).ratio() * 100
 
+def _token_set_ratio(a, b):
+    # Equivalente en difflib de rapidfuzz.fuzz.token_set_ratio (mismos casos especiales)
+    tokens_a, tokens_b = set(_RE_NON_ALNUM.sub(' ', a).lower().split()), set(_RE_NON_ALNUM.sub(' ', b).lower().split())
+    if not tokens_a or not tokens_b: return 0
+    intersection = " ".join(sorted(tokens_a & tokens_b))
+    diff_ab, diff_ba = " ".join(sorted(tokens_a - tokens_b)), " ".join(sorted(tokens_b - tokens_a))
+    if intersection and (not diff_ab or not diff_ba): return 100
+    if not intersection: return _ratio(diff_ab, diff_ba)
+    combined_ab, combined_ba = f"{intersection} {diff_ab}", f"{intersection} {diff_ba}"
+    return max(_ratio(intersection, combined_ab), _ratio(intersection, combined_ba), _ratio(combined_ab, combined_ba))
+
+@lru_cache(maxsize=8192)
 def calculate_similarity(a, b):
-    from difflib import SequenceMatcher
-    return SequenceMatcher(None, a, b).ratio() * 100
+    # Porcentaje 0-100 insensible a mayúsculas, puntuación y orden de palabras ("Matrix, The" == "The Matrix")
+    # Caso habitual en bibliotecas ya ordenadas: mismo texto salvo mayúsculas, con al menos una palabra → 100
+    if a and a.lower() == b.lower() and not _RE_NON_ALNUM.fullmatch(a):
+        return 100.0
+    if fuzz is not None:
+        return fuzz.token_set_ratio(a, b, processor=default_process)
+    return _token_set_ratio(a, b)
+
+@lru_cache(maxsize=8192)
+def calculate_auto_similarity(a, b):
+    # Para el renombrado automático token_set_ratio es demasiado generoso ("Scream" frente a "Scream 2" → 100):
+    # solo vale 100 si ambos títulos tienen las mismas palabras; si no, se usa el ratio simple
+    tokens_a, tokens_b = _RE_NON_ALNUM.sub(' ', a).lower().split(), _RE_NON_ALNUM.sub(' ', b).lower().split()
+    if tokens_a and set(tokens_a) == set(tokens_b):
+        return 100.0
+    if fuzz is not None:
+        return fuzz.ratio(a, b, processor=default_process)
+    return _ratio(" ".join(tokens_a), " ".join(tokens_b))
 
 # --- rename_file, log_rename, process_movie, list_movie_files ---
 # --- (Estas funciones permanecen igual que en v1.7.7, ya que los cambios ---
 # --- principales están en extract_basename y la lógica de comparación usa ---
 # --- el resultado de esa función y los umbrales de configuración)      ---
 
-def rename_file(file_path, new_name, debug_mode=False):
+def rename_file(file_path, new_name):
     # (Igual que en v1.7.7)
     new_path = os.path.join(os.path.dirname(file_path), new_name + os.path.splitext(file_path)[1])
-    print_debug(f"Intentando renombrar: {file_path} -> {new_path}", debug_mode, "rename_file")
+    print_debug("Intentando renombrar: %s -> %s", file_path, new_path, function_name="rename_file")
     if file_path == new_path:
         print(f"{Fore.LIGHTYELLOW_EX}El archivo ya tiene el nombre deseado. No se renombra.{Style.RESET_ALL}")
         return False
@@ -233,7 +410,7 @@ def rename_file(file_path, new_name, debug_mode=False):
                 if os.path.exists(temp_name): os.remove(temp_name)
                 os.rename(file_path, temp_name)
                 os.rename(temp_name, new_path)
-                print_debug(f"Archivo renombrado (solo mayúsculas/minúsculas): {file_path} -> {new_path}", debug_mode, "rename_file")
+                print_debug("Archivo renombrado (solo mayúsculas/minúsculas): %s -> %s", file_path, new_path, function_name="rename_file")
                 print(f"{Fore.LIGHTGREEN_EX}Archivo renombrado a: {new_path}{Style.RESET_ALL}")
                 log_rename(file_path, new_path)
                 return True
@@ -241,6 +418,7 @@ def rename_file(file_path, new_name, debug_mode=False):
                 print(f"{Fore.LIGHTRED_EX}Error al renombrar (solo mayúsculas/minúsculas): {e}{Style.RESET_ALL}")
                 if os.path.exists(temp_name) and not os.path.exists(file_path): os.rename(temp_name, file_path)
                 return False
+        flush_rename_log()
         while True:
             overwrite = input(f"{Fore.LIGHTRED_EX}El archivo {new_path} ya existe. ¿Desea sobreescribirlo? (s/n): {Style.RESET_ALL}").strip().lower()
             if overwrite in ['s', 'n']: break
@@ -250,7 +428,7 @@ def rename_file(file_path, new_name, debug_mode=False):
             return False
     try:
         os.replace(file_path, new_path)
-        print_debug(f"Archivo renombrado: {file_path} -> {new_path}", debug_mode, "rename_file")
+        print_debug("Archivo renombrado: %s -> %s", file_path, new_path, function_name="rename_file")
         print(f"{Fore.LIGHTGREEN_EX}Archivo renombrado a: {new_path}{Style.RESET_ALL}")
         log_rename(file_path, new_path)
         return True
@@ -259,159 +437,232 @@ def rename_file(file_path, new_name, debug_mode=False):
         return False
 
 def log_rename(old_path, new_path):
-    # (Igual que en v1.7.7)
+    global _LOG_FH
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log_entry = f"[{now}] Renombrado: {old_path} -> {new_path}\n"
-    with open(LOG_FILE, "a", encoding='utf-8') as log_file:
-        log_file.write(log_entry)
-
-def process_movie(video, headers, debug_mode=False):
-    # (Igual que en v1.7.7)
-    part_element = video.find(".//Part")
+    if _LOG_FH is None:
+        _LOG_FH = open(LOG_FILE, "a", encoding='utf-8', buffering=8192)
+        atexit.register(_LOG_FH.close)
+    _LOG_FH.write(log_entry)
+
+def flush_rename_log():
+    # Antes de esperar al usuario: lo ya renombrado queda en disco aunque la sesión se corte en la pregunta
+    if _LOG_FH is not None: _LOG_FH.flush()
+
+def classify_movie(video):
+    """Decide, sin red, qué flujo sigue la película a partir del nombre de archivo.
+
+    Devuelve (file_path, flujo, tmdb_id_del_nombre); flujo es "TMDB_DIRECT",
+    "ALREADY_TAGGED" (no necesita metadatos) o "NORMAL".
+    """
+    # iter(tag) filtra en C (lxml y ElementTree) sin pasar por el parser de rutas de find(".//Part")
+    part_element = next(video.iter("Part"), None)
     file_path = part_element.get("file", "N/A") if part_element is not None else "N/A"
     original_filename_base = os.path.basename(file_path)
-    tmdb_id_explicit_match = re.search(r'(?:tmdbid\s*=\s*|tmdb-)(\d+)', original_filename_base, re.IGNORECASE)
-    tmdb_presence_match = None
-    if not tmdb_id_explicit_match:
-        tmdb_presence_match = re.search(r'tmdbid|tmdb-', original_filename_base, re.IGNORECASE)
-    proceed_with_tmdb_logic = False
-    tmdb_id_extracted_from_filename = None
-    if tmdb_id_explicit_match:
-        tmdb_id_extracted_from_filename = tmdb_id_explicit_match.group(1)
-        proceed_with_tmdb_logic = True
-        print_debug(f"TMDB ID explícito ({tmdb_id_extracted_from_filename}) encontrado en nombre: {original_filename_base}. Renombrado directo.", debug_mode, "process_movie")
-    elif tmdb_presence_match:
-        proceed_with_tmdb_logic = True
-        print_debug(f"Presencia de 'tmdbid' o 'tmdb-' detectada (sin ID numérico explícito en nombre): {original_filename_base}. Se usará Plex meta para ID. Renombrado directo.", debug_mode, "process_movie")
-    if proceed_with_tmdb_logic:
-        rating_key = video.get("ratingKey")
-        metadata_url = f"{PLEX_BASE_URL}/library/metadata/{rating_key}"
-        metadata_xml = plex_request(metadata_url, headers, debug_mode)
+    tmdb_match = _RE_TMDB.search(original_filename_base)
+    if tmdb_match and tmdb_match.group(1) is None:
+        # Solo etiqueta en la primera aparición: un ID explícito más adelante sigue teniendo prioridad
+        tmdb_match = _RE_TMDB_EXPLICIT.search(original_filename_base, tmdb_match.start() + 1) or tmdb_match
+    if tmdb_match and tmdb_match.group(1):
+        tmdb_id_extracted_from_filename = tmdb_match.group(1)
+        print_debug("TMDB ID explícito (%s) encontrado en nombre: %s. Renombrado directo.", tmdb_id_extracted_from_filename, original_filename_base, function_name="classify_movie")
+        return file_path, "TMDB_DIRECT", tmdb_id_extracted_from_filename
+    if tmdb_match:
+        print_debug("Presencia de 'tmdbid' o 'tmdb-' detectada (sin ID numérico explícito en nombre): %s. Se usará Plex meta para ID. Renombrado directo.", original_filename_base, function_name="classify_movie")
+        return file_path, "TMDB_DIRECT", None
+    if _RE_ID_TAG.search(original_filename_base):
+        return file_path, "ALREADY_TAGGED", None
+    return file_path, "NORMAL", None
+
+def fetch_metadata(rating_key):
+    return plex_request(f"{PLEX_BASE_URL}/library/metadata/{rating_key}")
+
+def fetch_metadata_batch(rating_keys):
+    """
+    Metadatos de varias películas con una sola petición a /library/metadata/{k1,k2,...}.
+    Devuelve {ratingKey: <Video>}; las que no vengan en la respuesta (o si esta falla) se piden una a una.
+    """
+    batch_xml = plex_request(f"{PLEX_BASE_URL}/library/metadata/{','.join(rating_keys)}") if len(rating_keys) > 1 else None
+    metadata_by_key = {video.get("ratingKey"): video for video in batch_xml.iter("Video")} if batch_xml is not None else {}
+    for rating_key in rating_keys:
+        if rating_key not in metadata_by_key: metadata_by_key[rating_key] = fetch_metadata(rating_key)
+    return metadata_by_key
+
+_MISSING_IDS = frozenset(("na", "n/a"))
+
+def is_valid_id(value):
+    """True si el ID no está vacío ni es un marcador 'NA'/'N/A' (una sola llamada a lower())."""
+    return bool(value) and value.lower() not in _MISSING_IDS
+
+def process_movie(classification, metadata_xml):
+    # Recibe la clasificación de classify_movie y los metadatos ya descargados (None si falló la petición)
+    file_path, flow, tmdb_id_extracted_from_filename = classification
+    original_filename_base = os.path.basename(file_path)
+    base_name_from_file = _clean_basename(os.path.splitext(original_filename_base)[0]) # Igual que extract_basename(file_path)
+    if flow == "TMDB_DIRECT":
         if metadata_xml is None:
-            return file_path, None, None, None, None, extract_basename(file_path), True, "METADATA_ERROR_TMDB_DIRECT"
-        plex_imdb_id, plex_tmdb_id_from_meta = get_identifiers(metadata_xml)
-        title = metadata_xml.find(".//Video").get('title', 'Desconocido')
-        year = metadata_xml.find(".//Video").get('year', 'Desconocido')
+            return file_path, None, None, None, None, base_name_from_file, True, "METADATA_ERROR_TMDB_DIRECT"
+        video_el = video_node(metadata_xml)
+        plex_imdb_id, plex_tmdb_id_from_meta = get_identifiers(video_el)
+        title = video_el.get('title', 'Desconocido')
+        year = video_el.get('year', 'Desconocido')
         final_tmdb_id_for_object = tmdb_id_extracted_from_filename if tmdb_id_extracted_from_filename else plex_tmdb_id_from_meta
-        has_valid_plex_imdb = plex_imdb_id and plex_imdb_id.lower() not in ["na", "n/a"]
-        has_valid_final_tmdb = final_tmdb_id_for_object and final_tmdb_id_for_object.lower() not in ["na", "n/a"]
-        if not has_valid_plex_imdb and not has_valid_final_tmdb:
-            print_debug(f"TMDB logic: No se pudo asegurar un ID válido para {original_filename_base}. IMDb Plex: {plex_imdb_id}, TMDB Final: {final_tmdb_id_for_object}", debug_mode, "process_movie")
-            return file_path, plex_imdb_id, final_tmdb_id_for_object, title, year, extract_basename(file_path), True, "NO_ID_FOR_TMDB_DIRECT_RENAME"
-        return file_path, plex_imdb_id, final_tmdb_id_for_object, title, year, extract_basename(file_path), False, "TMDB_DIRECT_RENAME"
-    base_name_from_file = extract_basename(file_path) # Esta es la línea clave que se beneficia del cambio
-    filename_lower = original_filename_base.lower()
-    if re.search(r"\{imdb-tt\d+\}", filename_lower) or re.search(r"\{tmdb-\d+\}", filename_lower):
-        print_debug(f"Archivo ya parece tener un ID en formato estándar {{id-xxxx}}: {file_path}", debug_mode, "process_movie")
+        if not is_valid_id(plex_imdb_id) and not is_valid_id(final_tmdb_id_for_object):
+            print_debug("TMDB logic: No se pudo asegurar un ID válido para %s. IMDb Plex: %s, TMDB Final: %s", original_filename_base, plex_imdb_id, final_tmdb_id_for_object, function_name="process_movie")
+            return file_path, plex_imdb_id, final_tmdb_id_for_object, title, year, base_name_from_file, True, "NO_ID_FOR_TMDB_DIRECT_RENAME"
+        return file_path, plex_imdb_id, final_tmdb_id_for_object, title, year, base_name_from_file, False, "TMDB_DIRECT_RENAME"
+    if flow == "ALREADY_TAGGED":
+        print_debug("Archivo ya parece tener un ID en formato estándar {id-xxxx}: %s", file_path, function_name="process_movie")
         return file_path, None, None, None, None, base_name_from_file, True, "ALREADY_FORMATTED_ID_TAG"
-    rating_key = video.get("ratingKey")
-    metadata_url = f"{PLEX_BASE_URL}/library/metadata/{rating_key}"
-    print_debug(f"Petición HTTP para metadatos (flujo normal): {metadata_url}", debug_mode, "process_movie")
-    metadata_xml = plex_request(metadata_url, headers, debug_mode)
     if metadata_xml is None:
         return file_path, None, None, None, None, base_name_from_file, True, "METADATA_ERROR"
-    imdb_id, tmdb_id = get_identifiers(metadata_xml)
-    has_valid_imdb = imdb_id and imdb_id.lower() not in ["na", "n/a"]
-    has_valid_tmdb = tmdb_id and tmdb_id.lower() not in ["na", "n/a"]
-    if not has_valid_imdb and not has_valid_tmdb:
-        print_debug(f"No se encontró ID de IMDb ni TMDB válido en los metadatos para: {file_path}. IMDb: {imdb_id}, TMDB: {tmdb_id}", debug_mode, "process_movie")
+    video_el = video_node(metadata_xml)
+    imdb_id, tmdb_id = get_identifiers(video_el)
+    if not is_valid_id(imdb_id) and not is_valid_id(tmdb_id):
+        print_debug("No se encontró ID de IMDb ni TMDB válido en los metadatos para: %s. IMDb: %s, TMDB: %s", file_path, imdb_id, tmdb_id, function_name="process_movie")
         return file_path, imdb_id, tmdb_id, None, None, base_name_from_file, True, "NO_ID_FOUND"
-    title = metadata_xml.find(".//Video").get('title', 'Desconocido')
-    year = metadata_xml.find(".//Video").get('year', 'Desconocido')
-    similarity = calculate_similarity(base_name_from_file.lower(), title.lower()) # Ahora la similitud debería ser mayor
+    title = video_el.get('title', 'Desconocido')
+    year = video_el.get('year', 'Desconocido')
+    similarity = calculate_similarity(base_name_from_file, title)
     return file_path, imdb_id, tmdb_id, title, year, base_name_from_file, False, similarity
 
-def list_movie_files(debug_mode=False):
+def list_movie_files():
     # (Igual que en v1.7.7)
     print(f"{Fore.LIGHTGREEN_EX}Iniciando proceso para listar archivos de películas, sus nombres, IDs y comparación de títulos...{Style.RESET_ALL}")
-    sections = fetch_plex_sections(debug_mode)
+    sections = fetch_plex_sections()
     if sections is None: return
-    headers = {"X-Plex-Token": PLEX_TOKEN}
-    for section in sections.findall(".//Directory"):
-        if section.get("type") == "movie":
-            section_id = section.get("key")
-            section_title = section.get('title', 'Desconocida')
-            print_debug(f"Accediendo a la sección de películas '{section_title}' (ID: {section_id})", debug_mode, "list_movie_files")
-            movies = fetch_plex_movies(section_id, debug_mode)
-            if movies is None:
-                print(f"{Fore.LIGHTRED_EX}No se pudieron obtener películas para la sección {section_title}.{Style.RESET_ALL}")
-                continue
-            movie_videos = list(movies.findall(".//Video"))
-            total_movies = len(movie_videos)
-            print(f"{Fore.LIGHTBLUE_EX}Procesando sección: {section_title} - {total_movies} películas encontradas{Style.RESET_ALL}")
-            for i, video_item in enumerate(movie_videos, start=1):
-                try:
-                    file_path, imdb_id, tmdb_id, title, year, base_name_from_file, skip_processing, status_or_similarity = process_movie(video_item, headers, debug_mode)
-                    print(f"{Fore.LIGHTYELLOW_EX}{'-' * 40}{Style.RESET_ALL}")
-                    if skip_processing:
-                        if status_or_similarity == "ALREADY_FORMATTED_ID_TAG":
-                            print(f"{Fore.LIGHTYELLOW_EX}Saltando (ya etiquetado con ID en formato estándar): {os.path.basename(file_path)}{Style.RESET_ALL}")
-                        elif status_or_similarity in ["METADATA_ERROR", "METADATA_ERROR_TMDB_DIRECT"]:
-                             print(f"{Fore.LIGHTRED_EX}Error obteniendo metadatos para: {os.path.basename(file_path)}{Style.RESET_ALL}")
-                        elif status_or_similarity == "NO_ID_FOUND":
-                            print(f"{Fore.LIGHTYELLOW_EX}Saltando (sin ID de IMDb/TMDB en metadatos Plex): {os.path.basename(file_path)}{Style.RESET_ALL}")
-                        elif status_or_similarity == "NO_ID_FOR_TMDB_DIRECT_RENAME":
-                            print(f"{Fore.LIGHTYELLOW_EX}Saltando (TMDB detectado en nombre pero sin ID final usable de Plex): {os.path.basename(file_path)}{Style.RESET_ALL}")
-                        continue
-                    is_tmdb_direct_rename = (status_or_similarity == "TMDB_DIRECT_RENAME")
-                    similarity_value = 0 if is_tmdb_direct_rename else float(status_or_similarity)
-                    print(f"{Fore.LIGHTCYAN_EX}[{i}/{total_movies}] Archivo: {os.path.basename(file_path)}{Style.RESET_ALL}")
-                    if not is_tmdb_direct_rename:
-                        print(f"    {Fore.LIGHTCYAN_EX}Ruta: {file_path}{Style.RESET_ALL}")
-                        print(f"    {Fore.LIGHTMAGENTA_EX}Base actual limpia: '{base_name_from_file}'{Style.RESET_ALL}") # Debería reflejar el cambio
-                    id_display = f"IMDb: {imdb_id}" if imdb_id and imdb_id.lower() not in ["na", "n/a"] else "IMDb: N/A"
-                    id_display += f" / TMDB: {tmdb_id}" if tmdb_id and tmdb_id.lower() not in ["na", "n/a"] else " / TMDB: N/A"
-                    print(f"    {Fore.LIGHTCYAN_EX}Plex Meta: '{title}' ({year}) | {id_display}{Style.RESET_ALL}")
+    cache = open_metadata_cache()
+    try:
+        # Un solo recorrido del árbol de secciones con iter(), sin construir la lista de findall
+        for section in sections.iter("Directory"):
+            if section.get("type") == "movie":
+                process_section(section, cache)
+    finally:
+        if cache is not None:
+            cache.commit(); cache.close()
+
+def process_section(section, cache):
+    section_id = section.get("key")
+    section_title = section.get('title', 'Desconocida')
+    print_debug("Accediendo a la sección de películas '%s' (ID: %s)", section_title, section_id, function_name="process_section")
+    movies = [] # (video_item, classification, metadata_xml, batch) por película, en el orden de Plex
+    with ThreadPoolExecutor(max_workers=PLEX_MAX_WORKERS) as executor:
+        # Cada <Video> se clasifica según llega del listado y, si hace falta, su ratingKey se añade al lote
+        # en curso; cada METADATA_BATCH_SIZE películas se lanza una petición /library/metadata/{k1,k2,...},
+        # así que las descargas se solapan con la del propio listado con una petición por lote.
+        # batch es una lista [future] compartida por las películas del lote (el future se pone al lanzarlo).
+        pending_keys, batch = [], [None]
+        try:
+            for video_item in fetch_plex_movies(section_id):
+                classification = classify_movie(video_item)
+                metadata_xml, movie_batch = None, None
+                if classification[1] != "ALREADY_TAGGED":
+                    # El listado ya trae título, año y GUIDs; solo se pide el detalle si falta algún ID,
+                    # y aun así primero se mira la caché (misma película y mismo updatedAt)
+                    if any(get_identifiers(video_item)): metadata_xml = video_item
+                    else: metadata_xml = load_cached_metadata(cache, video_item)
+                    if metadata_xml is None and video_item.get("ratingKey"):
+                        pending_keys.append(video_item.get("ratingKey")); movie_batch = batch
+                        if len(pending_keys) >= METADATA_BATCH_SIZE:
+                            batch[0] = executor.submit(fetch_metadata_batch, pending_keys)
+                            pending_keys, batch = [], [None]
+                movies.append((video_item, classification, metadata_xml, movie_batch))
+            if pending_keys: batch[0] = executor.submit(fetch_metadata_batch, pending_keys)
+        except (requests.exceptions.RequestException, *XML_PARSE_ERRORS) as e:
+            print(f"{Fore.LIGHTRED_EX}Error leyendo el listado de Plex: {e}{Style.RESET_ALL}")
+            print(f"{Fore.LIGHTRED_EX}No se pudieron obtener películas para la sección {section_title}.{Style.RESET_ALL}")
+            # Se cancelan los lotes aún no iniciados (a mano: shutdown(cancel_futures=True) requiere Python 3.9)
+            for _, _, _, movie_batch in movies:
+                if movie_batch is not None and movie_batch[0] is not None: movie_batch[0].cancel()
+            return
+        total_movies = len(movies)
+        print(f"{Fore.LIGHTBLUE_EX}Procesando sección: {section_title} - {total_movies} películas encontradas{Style.RESET_ALL}")
+
+        # Los resultados se consumen en el orden original; el bucle interactivo avanza
+        # mientras el resto de peticiones sigue en curso.
+        for i, (video_item, classification, metadata_xml, movie_batch) in enumerate(movies, start=1):
+            try:
+                file_path = classification[0] # Para el mensaje de error si algo falla antes de process_movie
+                if movie_batch is not None:
+                    metadata_xml = movie_batch[0].result().get(video_item.get("ratingKey"))
+                    if metadata_xml is not None: store_cached_metadata(cache, video_item, metadata_xml)
+                file_path, imdb_id, tmdb_id, title, year, base_name_from_file, skip_processing, status_or_similarity = process_movie(classification, metadata_xml)
+                file_name = os.path.basename(file_path)
+                print(f"{Fore.LIGHTYELLOW_EX}{'-' * 40}{Style.RESET_ALL}")
+                if skip_processing:
+                    if status_or_similarity == "ALREADY_FORMATTED_ID_TAG":
+                        print(f"{Fore.LIGHTYELLOW_EX}Saltando (ya etiquetado con ID en formato estándar): {file_name}{Style.RESET_ALL}")
+                    elif status_or_similarity in ["METADATA_ERROR", "METADATA_ERROR_TMDB_DIRECT"]:
+                         print(f"{Fore.LIGHTRED_EX}Error obteniendo metadatos para: {file_name}{Style.RESET_ALL}")
+                    elif status_or_similarity == "NO_ID_FOUND":
+                        print(f"{Fore.LIGHTYELLOW_EX}Saltando (sin ID de IMDb/TMDB en metadatos Plex): {file_name}{Style.RESET_ALL}")
+                    elif status_or_similarity == "NO_ID_FOR_TMDB_DIRECT_RENAME":
+                        print(f"{Fore.LIGHTYELLOW_EX}Saltando (TMDB detectado en nombre pero sin ID final usable de Plex): {file_name}{Style.RESET_ALL}")
+                    continue
+                is_tmdb_direct_rename = (status_or_similarity == "TMDB_DIRECT_RENAME")
+                similarity_value = 0 if is_tmdb_direct_rename else float(status_or_similarity)
+                print(f"{Fore.LIGHTCYAN_EX}[{i}/{total_movies}] Archivo: {file_name}{Style.RESET_ALL}")
+                if not is_tmdb_direct_rename:
+                    print(f"    {Fore.LIGHTCYAN_EX}Ruta: {file_path}{Style.RESET_ALL}")
+                    print(f"    {Fore.LIGHTMAGENTA_EX}Base actual limpia: '{base_name_from_file}'{Style.RESET_ALL}") # Debería reflejar el cambio
+                # Validez de cada ID calculada una vez; se usa para mostrarlos y para elegir la etiqueta del nombre
+                imdb_valid, tmdb_valid = is_valid_id(imdb_id), is_valid_id(tmdb_id)
+                id_display = f"IMDb: {imdb_id}" if imdb_valid else "IMDb: N/A"
+                id_display += f" / TMDB: {tmdb_id}" if tmdb_valid else " / TMDB: N/A"
+                print(f"    {Fore.LIGHTCYAN_EX}Plex Meta: '{title}' ({year}) | {id_display}{Style.RESET_ALL}")
+                if not is_tmdb_direct_rename:
+                    print(f"{Fore.LIGHTGREEN_EX}    Similitud con nombre base: {similarity_value:.2f}%{Style.RESET_ALL}") # Esperamos que sea más alta ahora
+                # La extracción del año del nombre del archivo para year_match sigue usando el nombre original
+                filename_year_val = extract_year_from_filename(file_name)
+                metadata_year_val = int(year) if year and year.isdigit() else None
+                year_match = False
+                if filename_year_val and metadata_year_val:
+                    year_diff = abs(filename_year_val - metadata_year_val)
+                    year_match = year_diff <= YEAR_DIFF_AUTO
+                    print_debug("Año archivo: %s, Año meta: %s, Coinciden (diff<=%s): %s (dif: %s)", filename_year_val, metadata_year_val, YEAR_DIFF_AUTO, year_match, year_diff, function_name="process_section")
+                id_for_filename_tag = ""
+                if imdb_valid: id_for_filename_tag = f"{{imdb-{imdb_id}}}"
+                elif tmdb_valid: id_for_filename_tag = f"{{tmdb-{tmdb_id}}}"
+                if not id_for_filename_tag:
+                    print(f"{Fore.LIGHTYELLOW_EX}    No se pudo determinar un ID válido para el tag del nombre. No se propone renombrar.{Style.RESET_ALL}")
+                    continue
+                new_name_base = f"{title} ({year}) {id_for_filename_tag}".strip()
+                new_name_sanitized = sanitize_filename(new_name_base)
+                print(f"{Fore.LIGHTGREEN_EX}    Propuesta de nuevo nombre: {new_name_sanitized}{Style.RESET_ALL}")
+                auto_rename_triggered = False
+                if is_tmdb_direct_rename:
+                    auto_rename_triggered = True
+                    print(f"{Fore.LIGHTRED_EX}    Nombre de archivo original contiene TMDB ID/tag. Renombrando automáticamente.{Style.RESET_ALL}")
+                elif similarity_value >= SIMILARITY_AUTO and year_match and calculate_auto_similarity(base_name_from_file, title) >= SIMILARITY_AUTO: # Comparación de título puro ahora
+                    title_words = len(title.split())
+                    if title_words >= 2: auto_rename_triggered = True
+                    elif title_words == 1 and len(base_name_from_file.split()) == 1: # base_name_from_file ahora es título puro
+                         auto_rename_triggered = True
+                if auto_rename_triggered:
                     if not is_tmdb_direct_rename:
-                        print(f"{Fore.LIGHTGREEN_EX}    Similitud con nombre base: {similarity_value:.2f}%{Style.RESET_ALL}") # Esperamos que sea más alta ahora
-                    # La extracción del año del nombre del archivo para year_match sigue usando el nombre original
-                    filename_year_val = extract_year_from_filename(os.path.basename(file_path))
-                    metadata_year_val = int(year) if year and year.isdigit() else None
-                    year_match = False
-                    if filename_year_val and metadata_year_val:
-                        year_diff = abs(filename_year_val - metadata_year_val)
-                        year_match = year_diff <= YEAR_DIFF_AUTO
-                        print_debug(f"Año archivo: {filename_year_val}, Año meta: {metadata_year_val}, Coinciden (diff<={YEAR_DIFF_AUTO}): {year_match} (dif: {year_diff})", debug_mode, "list_movie_files")
-                    id_for_filename_tag = ""
-                    if imdb_id and imdb_id.lower() not in ["na", "n/a"]: id_for_filename_tag = f"{{imdb-{imdb_id}}}"
-                    elif tmdb_id and tmdb_id.lower() not in ["na", "n/a"]: id_for_filename_tag = f"{{tmdb-{tmdb_id}}}"
-                    if not id_for_filename_tag:
-                        print(f"{Fore.LIGHTYELLOW_EX}    No se pudo determinar un ID válido para el tag del nombre. No se propone renombrar.{Style.RESET_ALL}")
-                        continue
-                    new_name_base = f"{title} ({year}) {id_for_filename_tag}".strip()
-                    new_name_sanitized = sanitize_filename(new_name_base)
-                    print(f"{Fore.LIGHTGREEN_EX}    Propuesta de nuevo nombre: {new_name_sanitized}{Style.RESET_ALL}")
-                    auto_rename_triggered = False
-                    if is_tmdb_direct_rename:
-                        auto_rename_triggered = True
-                        print(f"{Fore.LIGHTRED_EX}    Nombre de archivo original contiene TMDB ID/tag. Renombrando automáticamente.{Style.RESET_ALL}")
-                    elif similarity_value >= SIMILARITY_AUTO and year_match: # Comparación de título puro ahora
-                        if len(title.split()) >= 2: auto_rename_triggered = True
-                        elif len(title.split()) == 1 and len(base_name_from_file.split()) == 1: # base_name_from_file ahora es título puro
-                             auto_rename_triggered = True
-                    if auto_rename_triggered:
-                        if not is_tmdb_direct_rename:
-                             print(f"{Fore.LIGHTRED_EX}    Similitud >= {SIMILARITY_AUTO}% (con año coincidente). Renombrando automáticamente.{Style.RESET_ALL}")
-                        rename_file(file_path, new_name_sanitized, debug_mode)
-                    elif similarity_value > SIMILARITY_ASK and not is_tmdb_direct_rename :
-                       while True:
-                           confirm = input(f"{Fore.LIGHTCYAN_EX}    ¿Desea renombrar este archivo? (s/n): {Style.RESET_ALL}").strip().lower()
-                           if confirm in ['s', 'n']: break
-                           print(f"{Fore.LIGHTYELLOW_EX}    Entrada no válida. Por favor, responda con 's' o 'n'.{Style.RESET_ALL}")
-                       if confirm == 's': rename_file(file_path, new_name_sanitized, debug_mode)
-                       else: print(f"{Fore.LIGHTYELLOW_EX}    Archivo no renombrado por el usuario.{Style.RESET_ALL}")
-                    elif not is_tmdb_direct_rename:
-                        print(f"{Fore.LIGHTYELLOW_EX}    Similitud ({similarity_value:.2f}%) no alcanza el umbral de {SIMILARITY_ASK}%. No se propone renombrar.{Style.RESET_ALL}")
-                except Exception as e:
-                    file_id_for_error = os.path.basename(file_path) if 'file_path' in locals() and file_path else f"elemento {i}"
-                    print(f"{Fore.LIGHTRED_EX}Error inesperado procesando {file_id_for_error}: {e}{Style.RESET_ALL}")
-                    import traceback
-                    print_debug(f"Traceback: {traceback.format_exc()}", debug_mode, "list_movie_files")
+                         print(f"{Fore.LIGHTRED_EX}    Similitud >= {SIMILARITY_AUTO}% (con año coincidente). Renombrando automáticamente.{Style.RESET_ALL}")
+                    rename_file(file_path, new_name_sanitized)
+                elif similarity_value > SIMILARITY_ASK and not is_tmdb_direct_rename :
+                   flush_rename_log()
+                   while True:
+                       confirm = input(f"{Fore.LIGHTCYAN_EX}    ¿Desea renombrar este archivo? (s/n): {Style.RESET_ALL}").strip().lower()
+                       if confirm in ['s', 'n']: break
+                       print(f"{Fore.LIGHTYELLOW_EX}    Entrada no válida. Por favor, responda con 's' o 'n'.{Style.RESET_ALL}")
+                   if confirm == 's': rename_file(file_path, new_name_sanitized)
+                   else: print(f"{Fore.LIGHTYELLOW_EX}    Archivo no renombrado por el usuario.{Style.RESET_ALL}")
+                elif not is_tmdb_direct_rename:
+                    print(f"{Fore.LIGHTYELLOW_EX}    Similitud ({similarity_value:.2f}%) no alcanza el umbral de {SIMILARITY_ASK}%. No se propone renombrar.{Style.RESET_ALL}")
+            except Exception as e:
+                file_id_for_error = os.path.basename(file_path) if 'file_path' in locals() and file_path else f"elemento {i}"
+                print(f"{Fore.LIGHTRED_EX}Error inesperado procesando {file_id_for_error}: {e}{Style.RESET_ALL}")
+                import traceback
+                print_debug("Traceback: %s", traceback.format_exc(), function_name="process_section")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Renombra archivos de películas en Plex basándose en metadatos y similitud.")
     parser.add_argument("-d", "--debug", action="store_true", help="Habilita el modo debug para mostrar información detallada.")
     args = parser.parse_args()
+    set_debug_mode(args.debug)
     
     config_data_loaded = load_config_file(CONFIG_FILE)
     if not config_data_loaded:
@@ -420,5 +671,6 @@ if __name__ == "__main__":
     
     if not verify_and_load_config(config_data_loaded, args.debug):
         exit(1)
+    init_session()
     
-    list_movie_files(args.debug)
+    list_movie_files()
@@ -1,4 +1,5 @@
 import os
+import errno
 import json
 import re
 import argparse
@@ -18,12 +19,23 @@ except ImportError:
 
 CONFIG_FILE = 'config.json'
 
+# Expresiones regulares precompiladas (se usan en cada película)
+_RE_ID_TAG = re.compile(r'(\{((imdb-tt|tmdb-)\d+)\})', re.IGNORECASE)
+# Un carácter no permitido pasaba a '-' y luego cada racha de espacios/guiones a ' ': equivale a sustituir
+# por ' ' cada racha de caracteres fuera de [\w.()[]{},!¡?¿] (espacios y guiones incluidos), en una pasada
+_RE_UNSAFE_RUN = re.compile(r'[^\w.()\[\]{},!¡?¿]+')
+_RE_PART_SUFFIX = re.compile(r'[\s._-](part|cd|disc|pt)\d+$', re.IGNORECASE)
+
 def cargar_configuracion():
     """Carga la configuración desde el archivo JSON."""
     try:
         with open(CONFIG_FILE, 'r') as f:
             config = json.load(f)
             config['patrones_regex'] = [re.compile(p, re.IGNORECASE) for p in config['patrones_nombre']]
+            config['patron_unificado'] = unificar_patrones(config['patrones_nombre'])
+            # Conjuntos para que cada comprobación de extensión sea O(1); en minúsculas como extension()
+            config['extensiones_video'] = frozenset(e.lower() for e in config['extensiones_video'])
+            config['archivos_a_eliminar_extensiones'] = frozenset(e.lower() for e in config['archivos_a_eliminar_extensiones'])
             return config
     except FileNotFoundError:
         print(f"{Fore.RED}Error: No se encontró el archivo de configuración '{CONFIG_FILE}'.")
@@ -32,6 +44,18 @@ def cargar_configuracion():
         print(f"{Fore.RED}Error: El archivo de configuración '{CONFIG_FILE}' no es un JSON válido.")
         return None
 
+def unificar_patrones(patrones):
+    """
+    Une los patrones en una sola alternancia (?:p1)|(?:p2)|... para buscar todos con un único search().
+    Devuelve None si no hay patrones o si la unión no compila (p. ej. flags en línea en mitad del patrón);
+    en ese caso se prueban uno a uno.
+    """
+    if not patrones: return None
+    try:
+        return re.compile("|".join(f"(?:{p})" for p in patrones), re.IGNORECASE)
+    except re.error:
+        return None
+
 def sanitize_filename(name):
     """
     Limpia un nombre para que sea seguro, protegiendo las etiquetas de ID.
@@ -40,15 +64,14 @@ def sanitize_filename(name):
     title_part = name
     
     # 1. Buscar y aislar la etiqueta de ID para protegerla
-    id_match = re.search(r'(\{((imdb-tt|tmdb-)\d+)\})', name, re.IGNORECASE)
+    id_match = _RE_ID_TAG.search(name)
     if id_match:
         id_tag = id_match.group(1)
         title_part = name.replace(id_tag, '')
 
     # 2. Sanear solo la parte del título
     # LÍNEA MODIFICADA: Se añaden ",!¡?¿" a la lista de caracteres permitidos.
-    sanitized_title = re.sub(r'[^\w\s.\-()\[\]{},!¡?¿]', '-', title_part)
-    sanitized_title = re.sub(r'[\s-]+', ' ', sanitized_title).strip()
+    sanitized_title = _RE_UNSAFE_RUN.sub(' ', title_part).strip()
     
     # 3. Reconstruir el nombre
     final_name = f"{sanitized_title} {id_tag}".strip() if sanitized_title and id_tag else sanitized_title + id_tag
@@ -61,31 +84,84 @@ def sanitize_filename(name):
 
 def get_base_movie_name(stem):
     """Elimina los indicadores comunes de partes múltiples de un nombre de archivo."""
-    part_regex = re.compile(r'[\s._-](part|cd|disc|pt)\d+$', re.IGNORECASE)
-    base_name = part_regex.sub('', stem)
+    # El sufijo (part1, cd2...) siempre termina en dígito: si no, no hace falta pasar la regex
+    # (lo habitual, ya que los nombres suelen acabar en la etiqueta {imdb-tt...})
+    if not stem[-1:].isdigit():
+        return stem.strip()
+    base_name = _RE_PART_SUFFIX.sub('', stem)
     return base_name.strip()
 
-def es_pelicula_procesable(path, config):
-    """Verifica si un archivo es una película que cumple los criterios para ser organizada."""
-    if not path.is_file() or path.suffix.lower() not in config['extensiones_video']:
+def extension(nombre):
+    """Extensión en minúsculas, igual que Path.suffix.lower() ('' para '.oculto' o 'nombre.')."""
+    i = nombre.rfind('.')
+    return nombre[i:].lower() if 0 < i < len(nombre) - 1 else ''
+
+def iterar_archivos(directorio):
+    """
+    Recorre directorio con os.scandir y devuelve el DirEntry de cada archivo. is_file()/is_dir() salen
+    del tipo que da el propio listado (sin un stat por entrada) y solo se guarda en memoria el listado
+    del directorio en curso y la pila de subdirectorios pendientes. No sigue enlaces a directorios.
+    """
+    pendientes = [directorio]
+    while pendientes:
+        try:
+            # Se lee el directorio entero antes de tocar nada: procesar sus archivos puede crear subdirectorios
+            with os.scandir(pendientes.pop()) as it:
+                entradas = list(it)
+        except OSError:
+            continue
+        subdirectorios = []
+        for entrada in entradas:
+            if entrada.is_dir(follow_symlinks=False):
+                subdirectorios.append(entrada.path)
+            elif entrada.is_file():
+                yield entrada
+        # Al revés en la pila para que se recorran en el orden del listado, igual que rglob
+        pendientes.extend(reversed(subdirectorios))
+
+def es_pelicula_procesable(entrada, config):
+    """Verifica si un archivo (DirEntry) es una película que cumple los criterios para ser organizada."""
+    if extension(entrada.name) not in config['extensiones_video']:
         return False
+    if config['patron_unificado'] is not None:
+        return config['patron_unificado'].search(entrada.name) is not None
     for patron in config['patrones_regex']:
-        if patron.search(path.name):
+        if patron.search(entrada.name):
             return True
     return False
 
-def procesar_directorio(directorio_base, config, execute_mode, archivos_procesados):
-    """Recorre un directorio, identifica películas y archivos, y los organiza de forma segura."""
+def mover_a_directorio(origen, directorio):
+    """
+    Mueve origen (str) dentro de directorio, que ya existe. En el mismo sistema de archivos basta un
+    os.rename (sin las comprobaciones previas de shutil.move); entre dispositivos se usa shutil.move.
+    Igual que shutil.move, no sobrescribe un archivo existente con el mismo nombre.
+    """
+    destino = os.path.join(directorio, os.path.basename(origen))
+    if os.path.lexists(destino):
+        raise shutil.Error(f"Destination path '{destino}' already exists")
+    try:
+        os.rename(origen, destino)
+    except OSError as e:
+        if e.errno != errno.EXDEV: raise
+        shutil.move(origen, destino)
+
+def procesar_directorio(directorio_base, config, execute_mode, archivos_procesados, archivos_vistos=None):
+    """
+    Recorre un directorio, identifica películas y archivos, y los organiza de forma segura.
+    Si se pasa archivos_vistos (lista), añade la ruta de cada archivo recorrido para el reporte final.
+    """
     print(f"\n--- {Style.BRIGHT}Procesando: {Fore.CYAN}{directorio_base}{Style.RESET_ALL} ---")
     if not os.path.isdir(directorio_base):
         print(f"{Fore.YELLOW}AVISO: El directorio '{directorio_base}' no existe. Omitiendo.")
         return
 
-    for path in list(Path(directorio_base).rglob('*')):
-        if not path.is_file(): continue
-
-        if path.suffix.lower() in config['archivos_a_eliminar_extensiones']:
-            archivos_procesados.add(path)
+    # Recorrido en streaming: no se construye la lista de todo el árbol ni un Path por cada archivo
+    base = Path(directorio_base)
+    for entrada in iterar_archivos(directorio_base):
+        if archivos_vistos is not None: archivos_vistos.append(entrada.path)
+        if extension(entrada.name) in config['archivos_a_eliminar_extensiones']:
+            path = Path(entrada.path)
+            archivos_procesados.add(entrada.path)
             print(f"{Fore.RED}{Style.BRIGHT}[ELIMINAR ARCHIVO]{Style.RESET_ALL} {Fore.CYAN}{path}{Style.RESET_ALL}")
             if execute_mode:
                 try: path.unlink(); print(f"{Fore.RED}  -> ELIMINADO.")
@@ -94,13 +170,18 @@ def procesar_directorio(directorio_base, config, execute_mode, archivos_procesad
                 print(f"{Fore.YELLOW}  -> SIMULADO.")
             continue
 
-        if es_pelicula_procesable(path, config):
-            archivos_procesados.add(path)
+        if es_pelicula_procesable(entrada, config):
+            path = Path(entrada.path)
+            archivos_procesados.add(entrada.path)
             
             base_name = get_base_movie_name(path.stem)
             sanitized_name = sanitize_filename(base_name)
-            ideal_parent_dir = Path(directorio_base) / sanitized_name
+            ideal_parent_dir = base / sanitized_name
             
+            # Ya organizado: comparación de cadenas sin syscalls (entrada.path se construye desde directorio_base);
+            # resolve() (realpath de ambos) solo cuando difieren, por mayúsculas o enlaces simbólicos
+            if os.path.dirname(entrada.path) == os.path.join(directorio_base, sanitized_name):
+                continue
             if path.parent.resolve() == ideal_parent_dir.resolve():
                 continue
 
@@ -111,7 +192,7 @@ def procesar_directorio(directorio_base, config, execute_mode, archivos_procesad
             if execute_mode:
                 try:
                     ideal_parent_dir.mkdir(exist_ok=True)
-                    shutil.move(str(path), str(ideal_parent_dir))
+                    mover_a_directorio(entrada.path, str(ideal_parent_dir))
                     print(f"{Fore.GREEN}    -> MOVIDO.")
                 except Exception as e:
                     print(f"{Fore.RED}    -> ERROR al mover: {e}")
@@ -120,40 +201,62 @@ def procesar_directorio(directorio_base, config, execute_mode, archivos_procesad
                     print(f"{Fore.GREEN}  [CREAR DIR]{Style.RESET_ALL} {Fore.CYAN}{ideal_parent_dir}{Style.RESET_ALL}")
                 print(f"{Fore.YELLOW}    -> SIMULADO.")
 
+def _eliminar_si_vacio(dirpath, execute_mode):
+    """
+    Recorre dirpath en postorden y elimina los subdirectorios vacíos y luego dirpath si queda vacío.
+    Cada directorio se lee una sola vez con os.scandir: queda vacío si todas sus entradas eran
+    subdirectorios que se acaban de borrar. Devuelve True si dirpath se ha borrado.
+    """
+    try:
+        with os.scandir(dirpath) as it:
+            entradas = list(it)
+    except OSError:
+        return False
+    quedan = 0
+    for entrada in entradas:
+        if not (entrada.is_dir(follow_symlinks=False) and _eliminar_si_vacio(entrada.path, execute_mode)):
+            quedan += 1
+    if quedan: return False
+    print(f"{Fore.RED}{Style.BRIGHT}[ELIMINAR DIR VACÍO]{Style.RESET_ALL} {Fore.CYAN}{dirpath}{Style.RESET_ALL}")
+    if not execute_mode:
+        print(f"{Fore.YELLOW}  -> SIMULADO.")
+        return False
+    try: os.rmdir(dirpath); print(f"{Fore.RED}  -> BORRADO.")
+    except OSError as e:
+        print(f"{Fore.RED}  -> ERROR al borrar: {e}")
+        return False
+    return True
+
 def limpiar_directorios_vacios(directorio, execute_mode):
-    """Elimina directorios vacíos de abajo hacia arriba."""
+    """Elimina directorios vacíos de abajo hacia arriba (el propio directorio nunca se borra)."""
     print(f"\n--- {Style.BRIGHT}Buscando directorios vacíos en: {Fore.CYAN}{directorio}{Style.RESET_ALL} ---")
-    for dirpath, _, _ in os.walk(directorio, topdown=False):
-        if os.path.realpath(dirpath) == os.path.realpath(directorio): continue
-        try:
-            if not os.listdir(dirpath):
-                print(f"{Fore.RED}{Style.BRIGHT}[ELIMINAR DIR VACÍO]{Style.RESET_ALL} {Fore.CYAN}{dirpath}{Style.RESET_ALL}")
-                if execute_mode:
-                    try: os.rmdir(dirpath); print(f"{Fore.RED}  -> BORRADO.")
-                    except OSError as e: print(f"{Fore.RED}  -> ERROR al borrar: {e}")
-                else:
-                    print(f"{Fore.YELLOW}  -> SIMULADO.")
-        except FileNotFoundError:
-            continue
+    try:
+        with os.scandir(directorio) as it:
+            subdirectorios = [entrada.path for entrada in it if entrada.is_dir(follow_symlinks=False)]
+    except OSError:
+        return
+    for subdirectorio in subdirectorios:
+        _eliminar_si_vacio(subdirectorio, execute_mode)
 
-def generar_reporte_sobrantes(directorios, archivos_procesados):
-    """Genera un reporte de archivos que no fueron procesados."""
+def generar_reporte_sobrantes(archivos_vistos, archivos_procesados):
+    """
+    Genera un reporte de archivos que no fueron procesados. Usa las rutas ya recogidas por
+    procesar_directorio (los archivos no procesados no se han tocado), sin recorrer el disco otra vez.
+    """
     print(f"\n\n{Back.BLUE}{Fore.WHITE}{Style.BRIGHT}--- REPORTE DE ARCHIVOS NO PROCESADOS ---{Style.RESET_ALL}")
     
     sobrantes_por_extension = defaultdict(list)
-    for directorio in directorios:
-        if not Path(directorio).is_dir(): continue
-        for path in Path(directorio).rglob('*'):
-            if path.is_file() and path.exists() and path not in archivos_procesados:
-                sobrantes_por_extension[path.suffix.lower()].append(str(path))
+    for ruta in archivos_vistos:
+        if ruta not in archivos_procesados:
+            sobrantes_por_extension[extension(os.path.basename(ruta))].append(ruta)
 
     if not sobrantes_por_extension:
         print(f"\n{Fore.GREEN}¡Excelente! No se encontraron archivos sobrantes.")
         return
     
     print(f"{Fore.YELLOW}Estos archivos no se movieron ni eliminaron (no coinciden con patrones de película ni de basura).")
-    for extension, archivos in sorted(sobrantes_por_extension.items()):
-        ext_name = extension if extension else '[Sin extensión]'
+    for ext, archivos in sorted(sobrantes_por_extension.items()):
+        ext_name = ext if ext else '[Sin extensión]'
         print(f"\n--- {Style.BRIGHT}Extensión: {Fore.YELLOW}{ext_name}{Style.RESET_ALL} ({len(archivos)} archivos) ---")
         for archivo in archivos:
             print(f"  - {Fore.CYAN}{archivo}{Style.RESET_ALL}")
@@ -175,14 +278,15 @@ def main():
     mode_text = " MODO EJECUCIÓN: ¡SE REALIZARÁN CAMBIOS REALES! " if args.execute else " MODO DRY-RUN (POR DEFECTO): NO SE REALIZARÁN CAMBIOS. "
     print(f"{header_color}{text_color}{Style.BRIGHT}{mode_text.center(70, '*')}{Style.RESET_ALL}")
     
-    archivos_procesados = set()
+    archivos_procesados = set() # Rutas (str) de los archivos movidos/eliminados: hash y comparación de str, no de Path
+    archivos_vistos = None if args.no_report else [] # Todos los archivos recorridos, en orden, para el reporte
     
     for dir_fuente in config['directorios_fuente']:
-        procesar_directorio(dir_fuente, config, args.execute, archivos_procesados)
+        procesar_directorio(dir_fuente, config, args.execute, archivos_procesados, archivos_vistos)
         limpiar_directorios_vacios(dir_fuente, args.execute)
 
     if not args.no_report:
-        generar_reporte_sobrantes(config['directorios_fuente'], archivos_procesados)
+        generar_reporte_sobrantes(archivos_vistos, archivos_procesados)
 
     print(f"\n--- {Style.BRIGHT}Proceso finalizado.{Style.RESET_ALL} ---")
     if not args.execute: